@@ -3,14 +3,16 @@ from .print_tree import print_tree
 from .api import *
 from .gfx import Layer, add_object
 from . import settings
-import time
+import queue, threading, time
 
-latin = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-numerals = "0123456789"
-punct = " .,<>/\\'[]{}:`~!@#$%^&*()_+?"
-keycmds = [
+latin = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+numerals = frozenset("0123456789")
+punct = frozenset(" .,<>/\\'[]{}:`~!@#$%^&*()_+?")
+keycmds = frozenset([
     "Backspace"
-]
+])
+# Keys which are typed as is
+typeable = numerals | punct | keycmds
 
 class App(EventLoop):
 
@@ -24,7 +26,8 @@ class App(EventLoop):
         self.chatbox_layer.resize(w, h)
 
         self.chatbox_layer.add_obj("outline")
-        self.chatbox_layer.add_obj("user_input")
+        # draw_txt() swaps this object out, so track its id
+        self.user_input_id = self.chatbox_layer.add_obj("user_input")
 
         self.cursor_layer = Layer("cursor_layer")
         self.cursor_layer.add_obj("cursor")
@@ -36,6 +39,11 @@ class App(EventLoop):
 
         self.user_input = ""
         self.last_keypress_time = 0
+        self.cursor_pos = None
+
+        # Text is redrawn on a separate thread so we keep receiving events
+        self.draw_queue = queue.Queue(maxsize=4)
+        threading.Thread(target=self.draw_worker, daemon=True).start()
 
     def resize_event(self, w, h):
         self.chatbox_layer.resize(w, h)
@@ -43,7 +51,7 @@ class App(EventLoop):
         self.rounded_box_layer.resize(w, h)
         resize_box()
         resize_rounded_box()
-        draw_txt(self.user_input)
+        self.queue_draw()
 
     def mouse_click(self, x, y):
         print(f"mouse click ({x}, {y})")
@@ -68,7 +76,7 @@ class App(EventLoop):
         elif keycode in latin:
             key = keycode.upper() if keymods.shift else keycode.lower()
             self.type_key(key, keymods, repeat)
-        elif keycode in numerals or keycode in punct or keycode in keycmds:
+        elif keycode in typeable:
             self.type_key(keycode, keymods, repeat)
         #else:
         #    print(keycode)
@@ -79,45 +87,70 @@ class App(EventLoop):
             return
         self.last_keypress_time = now
         if key == "Backspace":
-            self.user_input = self.user_input[:-1]
+            user_input = self.user_input[:-1]
         else:
-            self.user_input += key
-        draw_txt(self.user_input)
-
-def draw_txt(user_input):
-    obj_id = add_object("/window/chatbox_layer", "user_input2")
-    # create a new one and link it
-    text_id = host.create_text("/font/inter-regular", "txt2", user_input, 30)
-    link_node(text_id, obj_id)
-
-    layer_w = get_property("/window/chatbox_layer", "rect_w")
-    layer_h = get_property("/window/chatbox_layer", "rect_h")
-
-    x = 20
-    y = layer_h - 20 - 30
-
-    set_property_f32("/window/chatbox_layer/user_input2", "x", x)
-    set_property_f32("/window/chatbox_layer/user_input2", "y", y)
-    set_property_f32("/window/chatbox_layer/user_input2/txt2", "r", 1)
-    set_property_f32("/window/chatbox_layer/user_input2/txt2", "g", 1)
-    set_property_f32("/window/chatbox_layer/user_input2/txt2", "b", 1)
-    set_property_f32("/window/chatbox_layer/user_input2/txt2", "a", 1)
-
-    # Switch visibility
-    set_property_bool("/window/chatbox_layer/user_input",  "is_visible", False)
-    set_property_bool("/window/chatbox_layer/user_input2", "is_visible", True)
-
-    # Remove the old object
-    old_id = lookup_node("/window/chatbox_layer/user_input")
-    unlink_from_parents(old_id)
-    remove_node_recursive(old_id)
-
-    rename_node("/window/chatbox_layer/user_input2/txt2", "txt")
-    rename_node("/window/chatbox_layer/user_input2",      "user_input")
-
-    reposition_cursor()
-
-def reposition_cursor():
+            user_input = self.user_input + key
+        # Nothing to redraw, e.g. backspace on empty input
+        if user_input == self.user_input:
+            return
+        self.user_input = user_input
+        self.queue_draw()
+
+    def queue_draw(self):
+        # Only the latest input matters, so drop stale ones when full
+        while True:
+            try:
+                self.draw_queue.put_nowait(self.user_input)
+                return
+            except queue.Full:
+                try:
+                    self.draw_queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def draw_worker(self):
+        while True:
+            user_input = self.draw_queue.get()
+            # Hold the lock across the whole node swap so nobody else
+            # looks up user_input while it's half replaced.
+            with api.lock:
+                self.draw_txt(user_input)
+                self.cursor_pos = reposition_cursor(self.cursor_pos)
+
+    def draw_txt(self, user_input):
+        layer_id = self.chatbox_layer.id
+        obj_id = add_object(layer_id, "user_input2")
+        # create a new one and link it
+        text_id = host.create_text("/font/inter-regular", "txt2", user_input, 30)
+        link_node(text_id, obj_id)
+
+        layer_h = get_property(layer_id, "rect_h")
+
+        x = 20
+        y = layer_h - 20 - 30
+
+        set_property_f32(obj_id, "x", x)
+        set_property_f32(obj_id, "y", y)
+        set_property_f32(text_id, "r", 1)
+        set_property_f32(text_id, "g", 1)
+        set_property_f32(text_id, "b", 1)
+        set_property_f32(text_id, "a", 1)
+
+        # Switch visibility
+        set_property_bool(self.user_input_id, "is_visible", False)
+        set_property_bool(obj_id,             "is_visible", True)
+
+        # Remove the old object
+        unlink_from_parents(self.user_input_id)
+        remove_node_recursive(self.user_input_id)
+
+        rename_node(text_id, "txt")
+        rename_node(obj_id,  "user_input")
+        self.user_input_id = obj_id
+
+# Returns the new cursor position, skipping the update if it
+# didn't change from last_pos.
+def reposition_cursor(last_pos=None):
     layer_h = get_property("/window/chatbox_layer", "rect_h")
     y = layer_h - 20 - 30
 
@@ -131,8 +164,13 @@ def reposition_cursor():
     x = text_px_w + 25
     if user_input and user_input[-1] == " ":
         x += 10
-    set_property_f32("/window/cursor_layer/cursor", "x", x)
-    set_property_f32("/window/cursor_layer/cursor", "y", y)
+    if (x, y) == last_pos:
+        return last_pos
+    cursor_id = api.lookup_node_id("/window/cursor_layer/cursor")
+    with api.batch():
+        api.set_property_f32(cursor_id, "x", 0, float(x))
+        api.set_property_f32(cursor_id, "y", 0, float(y))
+    return (x, y)
 
 def draw_cursor():
     node_id = api.add_node("cursor_box", SceneNodeType.RENDER_MESH)
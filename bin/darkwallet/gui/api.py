@@ -1,5 +1,6 @@
 from collections import namedtuple
 from pydrk import Api, HostApi, PropertyType, PropertySubType, Property, serial
+import struct
 import zmq
 
 api = Api()
@@ -7,7 +8,7 @@ host = HostApi(api)
 print("Node status:", api.hello())
 
 def make_sub_socket():
-    context = zmq.Context()
+    context = zmq.Context.instance()
     socket = context.socket(zmq.SUB)
     socket.setsockopt(zmq.SUBSCRIBE, b'')
     socket.connect("tcp://localhost:9485")
@@ -83,25 +84,19 @@ def unlink_from_parents(node_id):
 
 def remove_node_recursive(node_id):
     node_id = lookup_node(node_id)
-
-    for (_, child_id, _) in api.get_children(node_id):
-        # Unlink the child
-        api.unlink_node(child_id, node_id)
-        # Remove the node
-        remove_node_recursive(child_id)
-
-    # Garbage collection
-    if not api.get_parents(node_id):
-        api.remove_node(node_id)
+    # The whole subtree is cleaned up on the host side
+    api.remove_subtree(node_id)
 
 def garbage_collect():
     dangling = api.scan_dangling()
-    for node_id in dangling:
-        remove_node_recursive(node_id)
+    api.remove_subtrees(dangling)
     print(f"Garbage collect: removed {len(dangling)} nodes")
 
 KeyMods = namedtuple("KeyMods", ["shift", "ctrl", "alt", "logo"])
 
+# shift, ctrl, alt, logo, repeat
+key_down_flags = struct.Struct("<5B")
+
 class EventLoop:
 
     def __init__(self):
@@ -113,37 +108,41 @@ class EventLoop:
         register_slot("/window/input/keyboard", "key_down",      b"kd")
 
     def run(self):
+        cur = serial.Cursor(b"")
         while True:
-            signal_data, user_data = self.subsock.recv_multipart()
-            cur = serial.Cursor(signal_data)
-            match user_data:
-                #case b"rs":
-                #    w = get_property("/window", "width")
-                #    h = get_property("/window", "height")
-                #    self.resize_event(w, h)
-                #case b"ck":
-                #    x = get_property("/window/input/mouse", "click_x")
-                #    y = get_property("/window/input/mouse", "click_y")
-                #    self.mouse_click(x, y)
-                #case b"wh":
-                #    y = get_property("/window/input/mouse", "wheel_y")
-                #    self.mouse_wheel(y)
-                #case b"mm":
-                #    pass
-                case b"kd":
-                    shift = bool(serial.read_u8(cur))
-                    ctrl = bool(serial.read_u8(cur))
-                    alt = bool(serial.read_u8(cur))
-                    logo = bool(serial.read_u8(cur))
-                    repeat = bool(serial.read_u8(cur))
-                    keycode = serial.decode_str(cur)
-
-                    keymods = KeyMods(shift, ctrl, alt, logo)
-                    # Sometimes these get stuck when exiting the window.
-                    # We don't need these anyway
-                    if keycode in ("LeftShift", "LeftSuper"):
-                        continue
-                    self.key_down(keycode, keymods, repeat)
+            # Avoid copying the frames, we just read from them in place
+            signal_data, user_data = self.subsock.recv_multipart(copy=False)
+            cur.reset(signal_data.buffer)
+            self.handle_signal(cur, user_data.bytes)
+
+    def handle_signal(self, cur, user_data):
+        match user_data:
+            #case b"rs":
+            #    w = get_property("/window", "width")
+            #    h = get_property("/window", "height")
+            #    self.resize_event(w, h)
+            #case b"ck":
+            #    x = get_property("/window/input/mouse", "click_x")
+            #    y = get_property("/window/input/mouse", "click_y")
+            #    self.mouse_click(x, y)
+            #case b"wh":
+            #    y = get_property("/window/input/mouse", "wheel_y")
+            #    self.mouse_wheel(y)
+            #case b"mm":
+            #    pass
+            case b"kd":
+                # Decode all the flags in one go
+                shift, ctrl, alt, logo, repeat = map(
+                    bool, key_down_flags.unpack_from(cur.by, cur.i))
+                cur.i += key_down_flags.size
+                keycode = serial.decode_str(cur)
+
+                keymods = KeyMods(shift, ctrl, alt, logo)
+                # Sometimes these get stuck when exiting the window.
+                # We don't need these anyway
+                if keycode in ("LeftShift", "LeftSuper"):
+                    return
+                self.key_down(keycode, keymods, repeat)
 
     def resize_event(self, w, h):
         pass
@@ -1,5 +1,11 @@
 from pydrk import SceneNodeType, PropertyType
 from .api import api
+import io, sys
+
+node_type_names = {t: t.name.lower() for t in SceneNodeType}
+
+# Precomputed indents so we don't rebuild them for every line
+indents = [" "*4*i for i in range(64)]
 
 def join(parent_path, child_name):
     if parent_path == "/":
@@ -7,49 +13,24 @@ def join(parent_path, child_name):
     return f"{parent_path}/{child_name}"
 
 def print_tree():
+    # Build the whole output then write it at once
+    buf = io.StringIO()
     root_id = api.lookup_node_id("/")
-    print("/")
-    print_node_info(root_id, indent=1)
+    buf.write("/\n")
+    print_node_info(buf, root_id, indent=1)
+    sys.stdout.write(buf.getvalue())
 
-def print_node_info(parent_id, indent):
-    ws = " "*4*indent
+def print_node_info(buf, parent_id, indent):
+    ws = indents[indent] if indent < len(indents) else " "*4*indent
     for (child_name, child_id, child_type) in api.get_children(parent_id):
-        match child_type:
-            case SceneNodeType.ROOT:
-                child_type = "root"
-            case SceneNodeType.WINDOW:
-                child_type = "window"
-            case SceneNodeType.WINDOW_INPUT:
-                child_type = "window_input"
-            case SceneNodeType.KEYBOARD:
-                child_type = "keyboard"
-            case SceneNodeType.MOUSE:
-                child_type = "mouse"
-            case SceneNodeType.RENDER_LAYER:
-                child_type = "render_layer"
-            case SceneNodeType.RENDER_OBJECT:
-                child_type = "render_object"
-            case SceneNodeType.RENDER_MESH:
-                child_type = "render_mesh"
-            case SceneNodeType.RENDER_TEXT:
-                child_type = "render_text"
-            case SceneNodeType.RENDER_TEXTURE:
-                child_type = "render_texture"
-            case SceneNodeType.FONTS:
-                child_type = "fonts"
-            case SceneNodeType.FONT:
-                child_type = "font"
-            case SceneNodeType.CHAT_VIEW:
-                child_type = "chat_view"
-            case SceneNodeType.EDIT_BOX:
-                child_type = "edit_box"
+        child_type = node_type_names.get(child_type, child_type)
 
         desc = f"{ws}{child_name}:{child_id}/"
         desc += " "*(50 - len(desc))
-        desc += f"[{child_type}]"
-        print(desc)
+        desc += f"[{child_type}]\n"
+        buf.write(desc)
 
-        print_node_info(child_id, indent+1)
+        print_node_info(buf, child_id, indent+1)
 
     for prop in api.get_properties(parent_id):
         if prop.type != PropertyType.BUFFER:
@@ -67,12 +48,12 @@ def print_node_info(parent_id, indent):
 
         prop_type = PropertyType.to_str(prop.type)
 
-        print(f"{ws}{prop.name}: {prop_type}{prop_val}")
+        buf.write(f"{ws}{prop.name}: {prop_type}{prop_val}\n")
 
     for sig in api.get_signals(parent_id):
-        print(f"{ws}~{sig}")
+        buf.write(f"{ws}~{sig}\n")
         for slot_id, slot in api.get_slots(parent_id, sig):
-            print(f"{ws}- '{slot}' ({slot_id})")
+            buf.write(f"{ws}- '{slot}' ({slot_id})\n")
 
     for method_name in api.get_methods(parent_id):
         args, results = api.get_method(parent_id, method_name)
@@ -81,5 +62,5 @@ def print_node_info(parent_id, indent):
         results = [f"{name}: " + PropertyType.to_str(typ) for (name, _, typ) in results]
 
         method_str = f"{method_name}(" + ", ".join(args) + ") -> (" + ", ".join(results) + ")"
-        print(f"{ws}{method_str}")
+        buf.write(f"{ws}{method_str}\n")
 
@@ -1,5 +1,10 @@
+import contextlib
+import functools
+import struct
+import threading
 import zmq
 from collections import namedtuple
+from enum import IntEnum
 from . import serial, exc, expr
 
 Property = namedtuple("Property", [
@@ -17,12 +22,13 @@ Property = namedtuple("Property", [
     "enum_items"
 ])
 
-class Command:
+class Command(IntEnum):
     HELLO = 0
     ADD_NODE = 1
     REMOVE_NODE = 9
     RENAME_NODE = 23
     SCAN_DANGLING = 24
+    REMOVE_SUBTREES = 25
     LOOKUP_NODE_ID = 12
     ADD_PROPERTY = 11
     LINK_NODE = 2
@@ -42,7 +48,7 @@ class Command:
     GET_METHOD = 21
     CALL_METHOD = 22
 
-class SceneNodeType:
+class SceneNodeType(IntEnum):
     NULL = 0
     ROOT = 1
     WINDOW = 2
@@ -61,7 +67,7 @@ class SceneNodeType:
     CHAT_VIEW = 16
     EDIT_BOX = 17
 
-class PropertyType:
+class PropertyType(IntEnum):
     NULL = 0
     BOOL = 1
     UINT32 = 2
@@ -74,27 +80,11 @@ class PropertyType:
 
     @staticmethod
     def to_str(prop_type):
-        match prop_type:
-            case PropertyType.NULL:
-                return "null"
-            case PropertyType.BOOL:
-                return "bool"
-            case PropertyType.UINT32:
-                return "uint32"
-            case PropertyType.FLOAT32:
-                return "float32"
-            case PropertyType.STR:
-                return "str"
-            case PropertyType.ENUM:
-                return "enum"
-            case PropertyType.BUFFER:
-                return "buffer"
-            case PropertyType.SCENE_NODE_ID:
-                return "scene_node_id"
-            case PropertyType.SEXPR:
-                return "sexpr"
-
-class PropertySubType:
+        return prop_type_names.get(prop_type)
+
+prop_type_names = {t: t.name.lower() for t in PropertyType}
+
+class PropertySubType(IntEnum):
     NULL = 0
     COLOR = 1
     PIXEL = 2
@@ -102,23 +92,17 @@ class PropertySubType:
 
     @staticmethod
     def to_str(prop_type):
-        match prop_type:
-            case PropertySubType.NULL:
-                return "null"
-            case PropertySubType.Color:
-                return "color"
-            case PropertySubType.PIXEL:
-                return "pixel"
-            case PropertySubType.RESOURCE_ID:
-                return "resource_id"
-
-class PropertyStatus:
+        return prop_subtype_names.get(prop_type)
+
+prop_subtype_names = {t: t.name.lower() for t in PropertySubType}
+
+class PropertyStatus(IntEnum):
     OK = 0
     UNSET = 1
     NULL = 2
     EXPR = 3
 
-class ErrorCode:
+class ErrorCode(IntEnum):
     INVALID_SCENE_PATH = 1
     NODE_NOT_FOUND = 2
     CHILD_NODE_NOT_FOUND = 3
@@ -154,213 +138,204 @@ class ErrorCode:
 
     @staticmethod
     def to_str(errc):
-        match errc:
-            case ErrorCode.INVALID_SCENE_PATH:
-                return "invalid_scene_path"
-            case ErrorCode.NODE_NOT_FOUND:
-                return "node_not_found"
-            case ErrorCode.CHILD_NODE_NOT_FOUND:
-                return "child_node_not_found"
-            case ErrorCode.PARENT_NODE_NOT_FOUND:
-                return "parent_node_not_found"
-            case ErrorCode.PROPERTY_ALREADY_EXISTS:
-                return "property_already_exists"
-            case ErrorCode.PROPERTY_NOT_FOUND:
-                return "property_not_found"
-            case ErrorCode.PROPERTY_WRONG_TYPE:
-                return "property_wrong_type"
-            case ErrorCode.PROPERTY_WRONG_LEN:
-                return "property_wrong_len"
-            case ErrorCode.PROPERTY_WRONG_INDEX:
-                return "property_wrong_index"
-            case ErrorCode.PROPERTY_OUT_OF_RANGE:
-                return "property_out_of_range"
-            case ErrorCode.PROPERTY_NULL_NOT_ALLOWED:
-                return "property_null_not_allowed"
-            case ErrorCode.PROPERTY_SEXPR_NOT_ALLOWED:
-                return "property_sexpr_not_allowed"
-            case ErrorCode.PROPERTY_IS_BOUNDED:
-                return "property_is_bounded"
-            case ErrorCode.PROPERTY_WRONG_ENUM_ITEM:
-                return "property_wrong_enum_item"
-            case ErrorCode.SIGNAL_ALREADY_EXISTS:
-                return "signal_already_exists"
-            case ErrorCode.SIGNAL_NOT_FOUND:
-                return "signal_not_found"
-            case ErrorCode.SLOT_NOT_FOUND:
-                return "slot_not_found"
-            case ErrorCode.METHOD_ALREADY_EXISTS:
-                return "method_already_exists"
-            case ErrorCode.METHOD_NOT_FOUND:
-                return "method_not_found"
-            case ErrorCode.NODES_ARE_LINKED:
-                return "nodes_are_linked"
-            case ErrorCode.NODES_NOT_LINKED:
-                return "nodes_not_linked"
-            case ErrorCode.NODE_HAS_PARENTS:
-                return "node_has_parents"
-            case ErrorCode.NODE_HAS_CHILDREN:
-                return "node_has_children"
-            case ErrorCode.NODE_PARENT_NAME_CONFLICT:
-                return "node_parent_name_conflict"
-            case ErrorCode.NODE_CHILD_NAME_CONFLICT:
-                return "node_child_name_conflict"
-            case ErrorCode.NODE_SIBLING_NAME_CONFLICT:
-                return "node_sibling_name_conflict"
-            case ErrorCode.FILE_NOT_FOUND:
-                return "file_not_found"
-            case ErrorCode.RESOURCE_NOT_FOUND:
-                return "resource_not_found"
-            case ErrorCode.PY_EVAL_ERR:
-                return "py_eval_err"
-            case ErrorCode.SEXPR_EMPTY:
-                return "sexpr_empty"
-            case ErrorCode.SEXPR_GLOBAL_NOT_FOUND:
-                return "sexpr_global_not_found"
+        return errc_names.get(errc)
+
+errc_names = {t: t.name.lower() for t in ErrorCode}
+
+errc_exceptions = {
+    ErrorCode.INVALID_SCENE_PATH:         exc.InvalidScenePath,
+    ErrorCode.NODE_NOT_FOUND:             exc.NodeNotFound,
+    ErrorCode.CHILD_NODE_NOT_FOUND:       exc.ChildNodeNotFound,
+    ErrorCode.PARENT_NODE_NOT_FOUND:      exc.ParentNodeNotFound,
+    ErrorCode.PROPERTY_ALREADY_EXISTS:    exc.PropertyAlreadyExists,
+    ErrorCode.PROPERTY_NOT_FOUND:         exc.PropertyNotFound,
+    ErrorCode.PROPERTY_WRONG_TYPE:        exc.PropertyWrongType,
+    ErrorCode.PROPERTY_WRONG_SUB_TYPE:    exc.PropertyWrongSubType,
+    ErrorCode.PROPERTY_WRONG_LEN:         exc.PropertyWrongLen,
+    ErrorCode.PROPERTY_WRONG_INDEX:       exc.PropertyWrongIndex,
+    ErrorCode.PROPERTY_OUT_OF_RANGE:      exc.PropertyOutOfRange,
+    ErrorCode.PROPERTY_NULL_NOT_ALLOWED:  exc.PropertyNullNotAllowed,
+    ErrorCode.PROPERTY_SEXPR_NOT_ALLOWED: exc.PropertySExprNotAllowed,
+    ErrorCode.PROPERTY_IS_BOUNDED:        exc.PropertyIsBounded,
+    ErrorCode.PROPERTY_WRONG_ENUM_ITEM:   exc.PropertyWrongEnumItem,
+    ErrorCode.SIGNAL_ALREADY_EXISTS:      exc.SignalAlreadyExists,
+    ErrorCode.SIGNAL_NOT_FOUND:           exc.SignalNotFound,
+    ErrorCode.SLOT_NOT_FOUND:             exc.SlotNotFound,
+    ErrorCode.METHOD_ALREADY_EXISTS:      exc.MethodAlreadyExists,
+    ErrorCode.METHOD_NOT_FOUND:           exc.MethodNotFound,
+    ErrorCode.NODES_ARE_LINKED:           exc.NodesAreLinked,
+    ErrorCode.NODES_NOT_LINKED:           exc.NodesNotLinked,
+    ErrorCode.NODE_HAS_PARENTS:           exc.NodeHasParents,
+    ErrorCode.NODE_HAS_CHILDREN:          exc.NodeHasChildren,
+    ErrorCode.NODE_PARENT_NAME_CONFLICT:  exc.NodeParentNameConflict,
+    ErrorCode.NODE_CHILD_NAME_CONFLICT:   exc.NodeChildNameConflict,
+    ErrorCode.NODE_SIBLING_NAME_CONFLICT: exc.NodeSiblingNameConflict,
+    ErrorCode.FILE_NOT_FOUND:             exc.FileNotFound,
+    ErrorCode.RESOURCE_NOT_FOUND:         exc.ResourceNotFound,
+    ErrorCode.PY_EVAL_ERR:                exc.PyEvalErr,
+    ErrorCode.SEXPR_EMPTY:                exc.SExprEmpty,
+    ErrorCode.SEXPR_GLOBAL_NOT_FOUND:     exc.SExprGlobalNotFound,
+}
+
+# Precompiled layouts for the fixed size parts of requests
+u32_layout = struct.Struct("<I")
+# [child_id] [parent_id]
+link_layout = struct.Struct("<II")
+# [i] [prop_type] [val]
+prop_header_layout = struct.Struct("<IB")
+prop_bool_layout = struct.Struct("<IBB")
+prop_u32_layout = struct.Struct("<IBI")
+prop_f32_layout = struct.Struct("<IBf")
+# [type] [subtype] [array_len]
+prop_info_layout = struct.Struct("<BBI")
+# [id] [type] following the name in get_children()/get_parents() replies
+node_entry_layout = struct.Struct("<IB")
+# x, y, r, g, b, a, u, v
+vertex_layout = struct.Struct("<8f")
+face_layout = struct.Struct("<3I")
 
 def vertex(x, y, r, g, b, a, u, v):
-    buf = bytearray()
-    serial.write_f32(buf, x)
-    serial.write_f32(buf, y)
-    serial.write_f32(buf, r)
-    serial.write_f32(buf, g)
-    serial.write_f32(buf, b)
-    serial.write_f32(buf, a)
-    serial.write_f32(buf, u)
-    serial.write_f32(buf, v)
-    return buf
+    return vertex_layout.pack(x, y, r, g, b, a, u, v)
 
 def face(idx1, idx2, idx3):
-    buf = bytearray()
-    serial.write_u32(buf, idx1)
-    serial.write_u32(buf, idx2)
-    serial.write_u32(buf, idx3)
-    return buf
+    return face_layout.pack(idx1, idx2, idx3)
+
+# Property, signal, slot and method names come from a small fixed set
+# so keep their encoded form around instead of redoing it per request.
+@functools.lru_cache(maxsize=4096)
+def encode_name(name):
+    by = bytearray()
+    serial.encode_str(by, name)
+    return bytes(by)
+
+# [node_id] [name] [fixed size tail] packed into one exactly sized buffer
+def node_request(node_id, name, layout, *vals):
+    name = encode_name(name)
+    off = u32_layout.size + len(name)
+    req = bytearray(off + layout.size)
+    u32_layout.pack_into(req, 0, node_id)
+    req[u32_layout.size:off] = name
+    layout.pack_into(req, off, *vals)
+    return req
+
+prop_val_readers = {
+    PropertyType.NULL:          lambda cur: None,
+    PropertyType.BOOL:          lambda cur: bool(serial.read_u8(cur)),
+    PropertyType.UINT32:        serial.read_u32,
+    PropertyType.FLOAT32:       serial.read_f32,
+    PropertyType.STR:           serial.decode_str,
+    PropertyType.ENUM:          serial.decode_str,
+    PropertyType.BUFFER:        lambda cur: None,
+    PropertyType.SCENE_NODE_ID: serial.read_u32,
+}
 
 class Api:
 
     def __init__(self, addr="127.0.0.1", port=9484):
-        context = zmq.Context()
-        self.socket = context.socket(zmq.REQ)
+        # Use the process wide context so extra clients don't each spin
+        # up their own io threads
+        context = zmq.Context.instance()
+        # DEALER lets us queue several requests before reading the replies.
+        # The host's REP socket still answers them one by one, in order.
+        self.socket = context.socket(zmq.DEALER)
         #self.socket.setsockopt(zmq.IPV6, True)
+        # Don't block on unsent requests when closing
+        self.socket.setsockopt(zmq.LINGER, 0)
         self.socket.connect(f"tcp://{addr}:{port}")
+        # The socket may be used from several threads
+        self.lock = threading.RLock()
+        # Number of replies still owed to us inside batch(), or None
+        self.batch_len = None
+
+    def close(self):
+        with self.lock:
+            self.socket.close()
+
+    def _send_request(self, cmd, payload):
+        # Empty delimiter frame which REP expects in front of the message
+        self.socket.send_multipart([b"", bytes((cmd,)), payload])
+
+    def _recv_reply(self):
+        _, errc, reply = self.socket.recv_multipart(copy=False)
+        errc = int.from_bytes(errc.buffer, "little")
+        # Decode straight out of the zmq frame
+        cursor = serial.Cursor(reply.buffer)
+        if errc:
+            exc_cls = errc_exceptions.get(errc)
+            if exc_cls is None:
+                raise Exception(f"unknown error code {errc} returned")
+            raise exc_cls
+        return cursor
 
     def _make_request(self, cmd, payload):
-        req_cmd = bytearray()
-        serial.write_u8(req_cmd, cmd)
-        self.socket.send_multipart([req_cmd, payload])
-
-        errc, reply = self.socket.recv_multipart()
-        errc = int.from_bytes(errc, "little")
-        cursor = serial.Cursor(reply)
-        match errc:
-            case 1:
-                raise exc.InvalidScenePath
-            case 2:
-                raise exc.NodeNotFound
-            case 3:
-                raise exc.ChildNodeNotFound
-            case 4:
-                raise exc.ParentNodeNotFound
-            case 5:
-                raise exc.PropertyAlreadyExists
-            case 6:
-                raise exc.PropertyNotFound
-            case 7:
-                raise exc.PropertyWrongType
-            case 8:
-                raise exc.PropertyWrongSubType
-            case 9:
-                raise exc.PropertyWrongLen
-            case 10:
-                raise exc.PropertyWrongIndex
-            case 11:
-                raise exc.PropertyOutOfRange
-            case 12:
-                raise exc.PropertyNullNotAllowed
-            case 12:
-                raise exc.PropertySExprNotAllowed
-            case 14:
-                raise exc.PropertyIsBounded
-            case 15:
-                raise exc.PropertyWrongEnumItem
-            case 16:
-                raise exc.SignalAlreadyExists
-            case 17:
-                raise exc.SignalNotFound
-            case 18:
-                raise exc.SlotNotFound
-            case 19:
-                raise exc.MethodAlreadyExists
-            case 20:
-                raise exc.MethodNotFound
-            case 21:
-                raise exc.NodesAreLinked
-            case 22:
-                raise exc.NodesNotLinked
-            case 23:
-                raise exc.NodeHasParents
-            case 24:
-                raise exc.NodeHasChildren
-            case 25:
-                raise exc.NodeParentNameConflict
-            case 26:
-                raise exc.NodeChildNameConflict
-            case 27:
-                raise exc.NodeSiblingNameConflict
-            case 28:
-                raise exc.FileNotFound
-            case 29:
-                raise exc.ResourceNotFound
-            case 30:
-                raise exc.PyEvalErr
-            case 31:
-                raise exc.SExprEmpty
-            case 32:
-                raise exc.SExprGlobalNotFound
-        return cursor
+        with self.lock:
+            self._send_request(cmd, payload)
+            if self.batch_len is not None:
+                self.batch_len += 1
+                return None
+            return self._recv_reply()
+
+    # Pipeline every request made inside the block, then wait for all
+    # of the replies at the end. Only use it for calls whose reply is
+    # not read, such as set_property_*() and link_node().
+    # The first error returned by the host is raised once all replies
+    # have been drained.
+    @contextlib.contextmanager
+    def batch(self):
+        with self.lock:
+            if self.batch_len is not None:
+                yield
+                return
+            self.batch_len = 0
+            try:
+                yield
+            finally:
+                batch_len, self.batch_len = self.batch_len, None
+                error = None
+                for _ in range(batch_len):
+                    try:
+                        self._recv_reply()
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                if error is not None:
+                    raise error
 
     def hello(self):
         response = self._make_request(Command.HELLO, bytearray())
         return serial.decode_str(response)
 
     def get_info(self, node_id):
-        req = bytearray()
-        serial.write_u32(req, node_id)
+        req = bytearray(u32_layout.pack(node_id))
         cur = self._make_request(Command.GET_INFO, req)
         name = serial.decode_str(cur)
         type = serial.read_u8(cur)
         return (name, type)
 
     def get_children(self, node_id):
-        req = bytearray()
-        serial.write_u32(req, node_id)
+        req = bytearray(u32_layout.pack(node_id))
         cur = self._make_request(Command.GET_CHILDREN, req)
         children_len = serial.decode_varint(cur)
-        children = []
-        for _ in range(children_len):
+        children = [None] * children_len
+        for i in range(children_len):
             child_name = serial.decode_str(cur)
-            child_id = serial.read_u32(cur)
-            child_type = serial.read_u8(cur)
-            children.append((child_name, child_id, child_type))
+            child_id, child_type = serial.read_struct(cur, node_entry_layout)
+            children[i] = (child_name, child_id, child_type)
         return children
 
     def get_parents(self, node_id):
-        req = bytearray()
-        serial.write_u32(req, node_id)
+        req = bytearray(u32_layout.pack(node_id))
         cur = self._make_request(Command.GET_PARENTS, req)
         parents_len = serial.decode_varint(cur)
-        parents = []
-        for _ in range(parents_len):
+        parents = [None] * parents_len
+        for i in range(parents_len):
             parent_name = serial.decode_str(cur)
-            parent_id = serial.read_u32(cur)
-            parent_type = serial.read_u8(cur)
-            parents.append((parent_name, parent_id, parent_type))
+            parent_id, parent_type = serial.read_struct(cur, node_entry_layout)
+            parents[i] = (parent_name, parent_id, parent_type)
         return parents
 
     def get_properties(self, node_id):
-        req = bytearray()
-        serial.write_u32(req, node_id)
+        req = bytearray(u32_layout.pack(node_id))
         cur = self._make_request(Command.GET_PROPERTIES, req)
         props_len = serial.decode_varint(cur)
         props = []
@@ -401,42 +376,27 @@ class Api:
 
     @staticmethod
     def read_prop_val(cur, prop_type):
-        match prop_type:
-            case PropertyType.NULL:
-                return None
-            case PropertyType.BOOL:
-                return bool(serial.read_u8(cur))
-            case PropertyType.UINT32:
-                return serial.read_u32(cur)
-            case PropertyType.FLOAT32:
-                return serial.read_f32(cur)
-            case PropertyType.STR:
-                return serial.decode_str(cur)
-            case PropertyType.ENUM:
-                return serial.decode_str(cur)
-            case PropertyType.BUFFER:
-                pass
-            case PropertyType.SCENE_NODE_ID:
-                return serial.read_u32(cur)
-            case _:
-                raise Exception("unknown property type returned")
+        read_fn = prop_val_readers.get(prop_type)
+        if read_fn is None:
+            raise Exception("unknown property type returned")
+        return read_fn(cur)
 
     def get_property_value(self, node_id, prop_name):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop_name)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(prop_name)
         cur = self._make_request(Command.GET_PROPERTY_VALUE, req)
         prop_type = serial.read_u8(cur)
+        # Every value shares the same type so resolve the reader once
+        read_val = prop_val_readers.get(prop_type)
+        if read_val is None:
+            raise Exception("unknown property type returned")
 
         def prop_read_fn(cur):
             prop_status = serial.read_u8(cur)
-            match prop_status:
-                case PropertyStatus.NULL:
-                    return None
-                case PropertyStatus.EXPR:
-                    return None
-                case PropertyStatus.UNSET | PropertyStatus.OK:
-                    return Api.read_prop_val(cur, prop_type)
+            if prop_status == PropertyStatus.NULL or \
+               prop_status == PropertyStatus.EXPR:
+                return None
+            return read_val(cur)
 
         vals = serial.decode_arr(cur, prop_read_fn)
         return vals
@@ -450,41 +410,46 @@ class Api:
         return node_id
 
     def remove_node(self, node_id):
-        req = bytearray()
-        serial.write_u32(req, node_id)
+        req = bytearray(u32_layout.pack(node_id))
         self._make_request(Command.REMOVE_NODE, req)
 
-    def rename_node(self, node_id, node_name):
+    def remove_subtree(self, node_id):
+        self.remove_subtrees([node_id])
+
+    # Removes each node together with all its descendants which
+    # are left without parents in a single request.
+    def remove_subtrees(self, node_ids):
         req = bytearray()
-        serial.write_u32(req, node_id)
+        serial.encode_varint(req, len(node_ids))
+        for node_id in node_ids:
+            serial.write_u32(req, node_id)
+        self._make_request(Command.REMOVE_SUBTREES, req)
+
+    def rename_node(self, node_id, node_name):
+        req = bytearray(u32_layout.pack(node_id))
         serial.encode_str(req, node_name)
         self._make_request(Command.RENAME_NODE, req)
 
     def scan_dangling(self):
         cur = self._make_request(Command.SCAN_DANGLING, bytearray())
         dangling_len = serial.decode_varint(cur)
-        dangling = []
-        for _ in range(dangling_len):
-            node_id = serial.read_u32(cur)
-            dangling.append(node_id)
-        return dangling
+        layout = struct.Struct(f"<{dangling_len}I")
+        return list(serial.read_struct(cur, layout))
 
     def lookup_node_id(self, node_path):
         req = bytearray()
         serial.encode_str(req, node_path)
         try:
             cur = self._make_request(Command.LOOKUP_NODE_ID, req)
-        except exc.RequestNodeNotFound:
+        except exc.NodeNotFound:
             return None
         return serial.read_u32(cur)
 
     def add_property(self, node_id, prop):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop.name)
-        serial.write_u8(req, int(prop.type))
-        serial.write_u8(req, int(prop.subtype))
-        serial.write_u32(req, int(prop.array_len))
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(prop.name)
+        req += prop_info_layout.pack(
+            int(prop.type), int(prop.subtype), int(prop.array_len))
 
         def write_defaults(by):
             assert prop.defaults is not None
@@ -532,93 +497,61 @@ class Api:
         self._make_request(Command.ADD_PROPERTY, req)
 
     def link_node(self, child_id, parent_id):
-        req = bytearray()
-        serial.write_u32(req, child_id)
-        serial.write_u32(req, parent_id)
+        req = link_layout.pack(child_id, parent_id)
         self._make_request(Command.LINK_NODE, req)
 
     def unlink_node(self, child_id, parent_id):
-        req = bytearray()
-        serial.write_u32(req, child_id)
-        serial.write_u32(req, parent_id)
+        req = link_layout.pack(child_id, parent_id)
         self._make_request(Command.UNLINK_NODE, req)
 
     def set_property_null(self, node_id, prop_name, i):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop_name)
-        serial.write_u32(req, i)
-        serial.write_u8(req, PropertyType.NULL)
+        req = node_request(node_id, prop_name, prop_header_layout, i, PropertyType.NULL)
         self._make_request(Command.SET_PROPERTY_VALUE, req)
 
     def set_property_bool(self, node_id, prop_name, i, val):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop_name)
-        serial.write_u32(req, i)
-        serial.write_u8(req, PropertyType.BOOL)
-        serial.write_u8(req, int(val))
+        req = node_request(node_id, prop_name, prop_bool_layout, i, PropertyType.BOOL, int(val))
         self._make_request(Command.SET_PROPERTY_VALUE, req)
 
     def set_property_u32(self, node_id, prop_name, i, val):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop_name)
-        serial.write_u32(req, i)
-        serial.write_u8(req, PropertyType.UINT32)
-        serial.write_u32(req, val)
+        req = node_request(node_id, prop_name, prop_u32_layout, i, PropertyType.UINT32, val)
         self._make_request(Command.SET_PROPERTY_VALUE, req)
 
     def set_property_f32(self, node_id, prop_name, i, val):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop_name)
-        serial.write_u32(req, i)
-        serial.write_u8(req, PropertyType.FLOAT32)
-        serial.write_f32(req, val)
+        req = node_request(node_id, prop_name, prop_f32_layout, i, PropertyType.FLOAT32, val)
         self._make_request(Command.SET_PROPERTY_VALUE, req)
 
     def set_property_str(self, node_id, prop_name, i, val):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop_name)
-        serial.write_u32(req, i)
-        serial.write_u8(req, PropertyType.STR)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(prop_name)
+        req += prop_header_layout.pack(i, PropertyType.STR)
         serial.encode_str(req, val)
         self._make_request(Command.SET_PROPERTY_VALUE, req)
 
     def set_property_enum(self, node_id, prop_name, i, val):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop_name)
-        serial.write_u32(req, i)
-        serial.write_u8(req, PropertyType.ENUM)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(prop_name)
+        req += prop_header_layout.pack(i, PropertyType.ENUM)
         serial.encode_str(req, val)
         self._make_request(Command.SET_PROPERTY_VALUE, req)
 
     def set_property_buf(self, node_id, prop_name, i, buf):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop_name)
-        serial.write_u32(req, i)
-        serial.write_u8(req, PropertyType.BUFFER)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(prop_name)
+        req += prop_header_layout.pack(i, PropertyType.BUFFER)
         serial.encode_buf(req, buf)
         self._make_request(Command.SET_PROPERTY_VALUE, req)
 
     def set_property_expr(self, node_id, prop_name, i, code):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, prop_name)
-        serial.write_u32(req, i)
-        serial.write_u8(req, PropertyType.SEXPR)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(prop_name)
+        req += prop_header_layout.pack(i, PropertyType.SEXPR)
         serial.encode_varint(req, len(code))
         for sexpr in code:
             expr.encode_expr(req, sexpr)
         self._make_request(Command.SET_PROPERTY_VALUE, req)
 
     def get_signals(self, node_id):
-        req = bytearray()
-        serial.write_u32(req, node_id)
+        req = bytearray(u32_layout.pack(node_id))
         cur = self._make_request(Command.GET_SIGNALS, req)
         sigs_len = serial.decode_varint(cur)
         sigs = []
@@ -627,10 +560,9 @@ class Api:
         return sigs
 
     def register_slot(self, node_id, sig_name, slot_name, user_data):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, sig_name)
-        serial.encode_str(req, slot_name)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(sig_name)
+        req += encode_name(slot_name)
         serial.encode_varint(req, len(user_data))
         req += user_data
         cur = self._make_request(Command.REGISTER_SLOT, req)
@@ -638,27 +570,24 @@ class Api:
         return slot_id
 
     def unregister_slot(self, node_id, sig_name, slot_id):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, sig_name)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(sig_name)
         serial.write_u32(req, slot_id)
         self._make_request(Command.UNREGISTER_SLOT, req)
 
     def lookup_slot_id(self, node_id, sig_name, slot_name):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, sig_name)
-        serial.encode_str(req, slot_name)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(sig_name)
+        req += encode_name(slot_name)
         try:
             cur = self._make_request(Command.LOOKUP_SLOT_ID, req)
-        except exc.RequestSlotNotFound:
+        except exc.SlotNotFound:
             return None
         return serial.read_u32(cur)
 
     def get_slots(self, node_id, sig_name):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, sig_name)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(sig_name)
         cur = self._make_request(Command.GET_SLOTS, req)
 
         def read_slot(cur):
@@ -670,8 +599,7 @@ class Api:
         return slots
 
     def get_methods(self, node_id):
-        req = bytearray()
-        serial.write_u32(req, node_id)
+        req = bytearray(u32_layout.pack(node_id))
         cur = self._make_request(Command.GET_METHODS, req)
 
         def read_method(cur):
@@ -682,9 +610,8 @@ class Api:
         return methods
 
     def get_method(self, node_id, method_name):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, method_name)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(method_name)
         cur = self._make_request(Command.GET_METHOD, req)
 
         def read_arg(cur):
@@ -699,12 +626,51 @@ class Api:
         return (args, results)
 
     def call_method(self, node_id, method_name, arg_data):
-        req = bytearray()
-        serial.write_u32(req, node_id)
-        serial.encode_str(req, method_name)
+        req = bytearray(u32_layout.pack(node_id))
+        req += encode_name(method_name)
         serial.encode_buf(req, arg_data)
         cur = self._make_request(Command.CALL_METHOD, req)
         errc = serial.read_u8(cur)
-        result = serial.decode_buf(cur)
+        # Copy out so the result outlives the reply frame
+        result = bytes(serial.decode_buf(cur))
         return (errc, result)
 
+
+# python -m pydrk.api
+if __name__ == "__main__":
+    # Stands in for the DEALER socket, answering with the given errcs
+    class FakeFrame:
+        def __init__(self, data):
+            self.buffer = memoryview(data)
+
+    class FakeSocket:
+        def __init__(self, errcs):
+            self.sent = []
+            self.replies = [[FakeFrame(b""), FakeFrame(bytes([errc])),
+                             FakeFrame(b"")] for errc in errcs]
+
+        def send_multipart(self, frames):
+            self.sent.append(frames)
+
+        def recv_multipart(self, copy=True):
+            return self.replies.pop(0)
+
+    api = Api.__new__(Api)
+    api.lock = threading.RLock()
+    api.batch_len = None
+    api.socket = FakeSocket([0, ErrorCode.NODE_NOT_FOUND,
+                             ErrorCode.SLOT_NOT_FOUND])
+
+    # Every reply is read once the block ends, then the first error raised
+    try:
+        with api.batch():
+            for node_id in range(3):
+                api.set_property_f32(node_id, "x", 0, 1.0)
+            assert len(api.socket.sent) == 3
+            assert len(api.socket.replies) == 3
+    except exc.NodeNotFound:
+        pass
+    else:
+        assert False, "batch() swallowed the error"
+    assert not api.socket.replies
+    assert api.batch_len is None
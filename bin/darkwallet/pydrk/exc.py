@@ -54,6 +54,8 @@ class NodeSiblingNameConflict(Exception):
     pass
 class FileNotFound(Exception):
     pass
+class ResourceNotFound(Exception):
+    pass
 class PyEvalErr(Exception):
     pass
 class SExprEmpty(Exception):
@@ -1,6 +1,8 @@
+import struct
+from enum import IntEnum
 from . import serial
 
-class Op:
+class Op(IntEnum):
     NULL = 0
     ADD = 1
     SUB = 2
@@ -19,56 +21,51 @@ class Op:
 
     @staticmethod
     def from_str(op):
-        match op:
-            case "null":
-                return Op.NULL
-            case "+":
-                return Op.ADD
-            case "-":
-                return Op.SUB
-            case "*":
-                return Op.MUL
-            case "/":
-                return Op.DIV
-            case "bool":
-                return Op.CONST_BOOL
-            case "u32":
-                return Op.CONST_UINT_32
-            case "f32":
-                return Op.CONST_FLOAT_32
-            case "str":
-                return Op.CONST_STR
-            case "load":
-                return Op.LOAD_VAR
-            case "min":
-                return Op.MIN
-            case "max":
-                return Op.MAX
-            case "==":
-                return Op.IS_EQUAL
-            case "<":
-                return Op.LESS_THAN
-            case "as_u32":
-                return Op.FLOAT32_TO_UINT32
+        return op_codes.get(op)
+
+op_codes = {
+    "null":   Op.NULL,
+    "+":      Op.ADD,
+    "-":      Op.SUB,
+    "*":      Op.MUL,
+    "/":      Op.DIV,
+    "bool":   Op.CONST_BOOL,
+    "u32":    Op.CONST_UINT_32,
+    "f32":    Op.CONST_FLOAT_32,
+    "str":    Op.CONST_STR,
+    "load":   Op.LOAD_VAR,
+    "min":    Op.MIN,
+    "max":    Op.MAX,
+    "==":     Op.IS_EQUAL,
+    "<":      Op.LESS_THAN,
+    "as_u32": Op.FLOAT32_TO_UINT32,
+}
+
+# [op] [val]
+const_bool_layout = struct.Struct("<BB")
+const_u32_layout = struct.Struct("<BI")
+const_f32_layout = struct.Struct("<Bf")
 
 def encode_expr(by, code):
-    op, args = code[0], code[1:]
-    op = Op.from_str(op)
-    serial.write_u8(by, op)
-    match op:
-        case Op.CONST_BOOL:
-            serial.write_u8(by, int(args[0]))
-        case Op.CONST_UINT_32:
-            serial.write_u32(by, args[0])
-        case Op.CONST_FLOAT_32:
-            serial.write_f32(by, args[0])
-        case Op.CONST_STR:
-            serial.encode_str(by, args[0])
-        case Op.LOAD_VAR:
-            serial.encode_str(by, args[0])
-        case _:
-            for arg in args:
-                encode_expr(by, arg)
+    # Walk the tree with an explicit stack instead of recursing per node.
+    # Args are pushed in reverse so they get popped in order.
+    stack = [code]
+    while stack:
+        op, *args = stack.pop()
+        op = op_codes[op]
+        match op:
+            case Op.CONST_BOOL:
+                by += const_bool_layout.pack(op, int(args[0]))
+            case Op.CONST_UINT_32:
+                by += const_u32_layout.pack(op, args[0])
+            case Op.CONST_FLOAT_32:
+                by += const_f32_layout.pack(op, args[0])
+            case Op.CONST_STR | Op.LOAD_VAR:
+                by.append(op)
+                serial.encode_str(by, args[0])
+            case _:
+                by.append(op)
+                stack.extend(reversed(args))
 
 # python -m pydrk.expr
 if __name__ == "__main__":
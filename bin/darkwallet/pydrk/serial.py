@@ -1,23 +1,26 @@
 import struct
 
+u8 = struct.Struct("<B")
+u16 = struct.Struct("<H")
+u32 = struct.Struct("<I")
+u64 = struct.Struct("<Q")
+f32 = struct.Struct("<f")
+
+# Struct.pack() already rejects values which don't fit
 def write_u8(by, v):
-    assert v < 2**256
-    by += v.to_bytes(1, 'little')
+    by += u8.pack(v)
 
 def write_u16(by, v):
-    assert v < 2**(2*256)
-    by += v.to_bytes(2, 'little')
+    by += u16.pack(v)
 
 def write_u32(by, v):
-    assert v < 2**(4*256)
-    by += v.to_bytes(4, 'little')
+    by += u32.pack(v)
 
 def write_u64(by, v):
-    assert v < 2**(8*256)
-    by += v.to_bytes(8, 'little')
+    by += u64.pack(v)
 
 def write_f32(by, v):
-    by += struct.pack("<f", v)
+    by += f32.pack(v)
 
 def encode_varint(by, v):
     if v <= 0xfc:
@@ -48,12 +51,17 @@ def encode_opt(by, val, write_fn):
         write_fn(by)
 
 # Cursor for bytearray type
+# Also accepts memoryview so zmq frames can be read without copying
 class Cursor:
 
     def __init__(self, by):
         self.by = by
         self.i = 0
 
+    def reset(self, by):
+        self.by = by
+        self.i = 0
+
     def read(self, n):
         slice = self.by[self.i:self.i+n]
         self.i += n
@@ -62,27 +70,38 @@ class Cursor:
         return slice
 
 def read_u8(cur):
-    b = cur.read(1)
-    return int.from_bytes(b, "little")
+    i = cur.i
+    if i >= len(cur.by):
+        raise Exception("invalid read")
+    cur.i = i + 1
+    return cur.by[i]
+
+# Unpack a fixed size run of fields described by a struct.Struct
+# directly from the underlying buffer, without slicing it first.
+def read_struct(cur, layout):
+    try:
+        vals = layout.unpack_from(cur.by, cur.i)
+    except struct.error:
+        raise Exception("invalid read")
+    cur.i += layout.size
+    return vals
 
 def read_u16(cur):
-    b = cur.read(2)
-    return int.from_bytes(b, "little")
+    return read_struct(cur, u16)[0]
 
 def read_u32(cur):
-    b = cur.read(4)
-    return int.from_bytes(b, "little")
+    return read_struct(cur, u32)[0]
 
 def read_u64(cur):
-    b = cur.read(8)
-    return int.from_bytes(b, "little")
+    return read_struct(cur, u64)[0]
 
 def read_f32(cur):
-    by = cur.read(4)
-    return struct.unpack("<f", by)[0]
+    return read_struct(cur, f32)[0]
 
 def decode_varint(cur):
     n = read_u8(cur)
+    if n < 0xfd:
+        return n
     match n:
         case 0xff:
             x = read_u64(cur)
@@ -99,7 +118,7 @@ def decode_varint(cur):
     return n
 
 def decode_str(cur):
-    return decode_buf(cur).decode("utf-8")
+    return str(decode_buf(cur), "utf-8")
 
 def decode_buf(cur):
     size = decode_varint(cur)
@@ -21,6 +21,7 @@ enum Command {
     RemoveNode = 9,
     RenameNode = 23,
     ScanDangling = 24,
+    RemoveSubtrees = 25,
     LookupNodeId = 12,
     AddProperty = 11,
     LinkNode = 2,
@@ -222,6 +223,13 @@ impl ZeroMQAdapter {
                 debug!(target: "req", "{:?}({}, {})", cmd, node_id, node_name);
                 scene_graph.rename_node(node_id, node_name)?;
             }
+            Command::RemoveSubtrees => {
+                let node_ids = Vec::<SceneNodeId>::decode(&mut cur).unwrap();
+                debug!(target: "req", "{:?}({:?})", cmd, node_ids);
+                for node_id in node_ids {
+                    scene_graph.remove_subtree(node_id)?;
+                }
+            }
             Command::ScanDangling => {
                 let dangling = scene_graph.scan_dangling();
                 dangling.encode(&mut reply).unwrap();
@@ -153,6 +153,27 @@ impl SceneGraph {
         Ok(())
     }
 
+    /// Unlink and remove all descendants which are left without parents, then remove
+    /// the node itself if it has no parents.
+    pub fn remove_subtree(&mut self, id: SceneNodeId) -> Result<()> {
+        let node = self.get_node(id).ok_or(Error::NodeNotFound)?;
+        let child_ids: Vec<_> = node.children.iter().map(|child_inf| child_inf.id).collect();
+
+        for child_id in child_ids {
+            self.unlink(child_id, id)?;
+            // Still in use elsewhere in the tree
+            if !self.get_node(child_id).unwrap().parents.is_empty() {
+                continue
+            }
+            self.remove_subtree(child_id)?;
+        }
+
+        if self.get_node(id).unwrap().parents.is_empty() {
+            self.remove_node(id)?;
+        }
+        Ok(())
+    }
+
     fn root(&self) -> &SceneNode {
         &self.nodes[0]
     }
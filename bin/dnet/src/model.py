@@ -15,147 +15,169 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import logging, time 
-import datetime as dt
-from collections import defaultdict as dd
+import logging, time, asyncio
+from collections import defaultdict as dd, deque
+from functools import lru_cache, partial
+
+
+# Events arrive in bursts within the same second, so cache the formatting.
+# Formatting the fields directly skips strftime's locale handling.
+@lru_cache(maxsize=256)
+def format_time(secs):
+    t = time.localtime(secs)
+    return f'{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}'
 
 
 class Model:
 
-    def __init__(self):
+    # msg_ring is how many messages we keep per channel, older ones
+    # are dropped as new ones arrive.
+    def __init__(self, msg_ring=1000):
         self.nodes = {}
         self.liliths = {}
-
-    def add_node(self, node):
+        self.msg_ring = msg_ring
+        # Bumped and set on every update so the view knows when to redraw
+        self.version = 0
+        self.changed = asyncio.Event()
+        self.snapshot_version = None
+        self.snapshot = ((), ())
+
+    def notify(self):
+        self.version += 1
+        self.changed.set()
+
+    # The view keeps iterating over nodes across awaits, while updates
+    # keep coming in. Hand out tuples that stay valid, and only rebuild
+    # them when the model actually changed.
+    def items(self):
+        if self.snapshot_version != self.version:
+            self.snapshot = (tuple(self.nodes.items()),
+                             tuple(self.liliths.items()))
+            self.snapshot_version = self.version
+        return self.snapshot
+
+    def add_node(self, name, values):
+        self.notify()
         channel_lookup = {}
-        name = list(node.keys())[0]
-        values = list(node.values())[0]
         info = values['result']
         channels = info['channels']
         
-        self.nodes[name] = {}
-        self.nodes[name]['outbound'] = {}
-        self.nodes[name]['inbound'] = {}
-        self.nodes[name]['manual'] = {}
-        self.nodes[name]['event'] = {}
-        self.nodes[name]['seed'] = {}
-        self.nodes[name]['msgs'] = dd(list)
+        node = self.nodes[name] = {k: {} for k in
+            ('outbound', 'inbound', 'manual', 'event', 'seed')}
+        node['msgs'] = dd(partial(deque, maxlen=self.msg_ring))
 
+        # Index the channels and sort them into their sessions in a
+        # single pass. Outbound channels are listed by slot below.
+        sessions = {k: node[k] for k in ('inbound', 'seed', 'manual')}
         for channel in channels:
             id = channel['id']
             channel_lookup[id] = channel
-
-        for channel in channels:
-            if channel['session'] != 'inbound':
-                continue
-            id = channel['id']
-            url = channel_lookup[id]['url']
-            self.nodes[name]['inbound'][f'{id}'] = url
+            session = sessions.get(channel['session'])
+            if session is not None:
+                session[id] = channel['url']
 
         for i, id in enumerate(info['outbound_slots']):
             if id == 0:
-                outbounds = self.nodes[name]['outbound'][f'{i}'] = ['none', 0]
+                node['outbound'][i] = ['none', 0]
                 continue
             assert id in channel_lookup
             url = channel_lookup[id]['url']
-            outbounds = self.nodes[name]['outbound'][f'{i}'] = [url, id]
-
-        for channel in channels:
-            if channel['session'] != 'seed':
-                continue
-            id = channel['id']
-            url = channel['url']
-            self.nodes[name]['seed'][f'{id}'] = url
-
-        for channel in channels:
-            if channel['session'] != 'manual':
-                continue
-            id = channel['id']
-            url = channel['url']
-            self.nodes[name]['manual'][f'{id}'] = url
+            node['outbound'][i] = [url, id]
     
-    def add_offline(self, node):
-        name = list(node.keys())[0]
-        values = list(node.values())[0]
+    def add_offline(self, name, values):
+        self.notify()
         self.nodes[name] = values
 
-    def add_event(self, event):
-        name = list(event.keys())[0]
-        values = list(event.values())[0]
-        params = values.get('params')
-        event = params[0].get('event')
-        info = params[0].get('info')
-
-        t = time.localtime()
-        current_time = time.strftime('%H:%M:%S', t)
-
-        match event:                        
-            case 'send':
-                nano = info.get('time')
-                cmd = info.get('cmd')
-                chan = info.get('chan')
-                addr = chan.get('addr')
-                t = (dt.datetime
-                        .fromtimestamp(int(nano)/1000000000)
-                        .strftime('%H:%M:%S'))
-                msgs = self.nodes[name]['msgs']
-                msgs[addr].append((t, event, cmd))
-            case 'recv':
-                nano = info.get('time')
-                cmd = info.get('cmd')
-                chan = info.get('chan')
-                addr = chan.get('addr')
-                t = (dt.datetime
-                        .fromtimestamp(int(nano)/1000000000)
-                        .strftime('%H:%M:%S'))
-                msgs = self.nodes[name]['msgs']
-                msgs[addr].append((t, event, cmd))
+    def add_event(self, name, values):
+        self.notify()
+        params = values['params'][0]
+        event = params['event']
+        info = params['info']
+        node = self.nodes[name]
+
+        # Message events are by far the most frequent, so handle them
+        # before computing the timestamp used for logging below.
+        if event in ('send', 'recv'):
+            t = format_time(int(info['time']) // 1_000_000_000)
+            addr = info['chan']['addr']
+            node['msgs'][addr].append((t, event, info['cmd']))
+            return
+
+        # Only used for logging, which is usually disabled
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        current_time = format_time(int(time.time())) if debug else None
+
+        match event:
             case 'inbound_connected':
                 addr = info['addr']
-                id = info.get('channel_id')
-                self.nodes[name]['inbound'][f'{id}'] = addr
-                logging.debug(f'{current_time}  inbound (connect):    {addr}')
+                id = info['channel_id']
+                node['inbound'][id] = addr
+                logging.debug('%s  inbound (connect):    %s', current_time, addr)
             case 'inbound_disconnected':
                 addr = info['addr']
-                id = info.get('channel_id')
-                self.nodes[name]['inbound'][f'{id}'] = {}
-                logging.debug(f'{current_time}  inbound (disconnect): {addr}')
+                id = info['channel_id']
+                node['inbound'].pop(id, None)
+                logging.debug('%s  inbound (disconnect): %s', current_time, addr)
             case 'outbound_slot_sleeping':
                 slot = info['slot']
-                event = self.nodes[name]['event']
-                event[(f'{name}', f'{slot}')] = ['sleeping', 0]
-                logging.debug(f'{current_time}  slot {slot}: sleeping')
+                events = node['event']
+                events[slot] = ['sleeping', 0]
+                logging.debug('%s  slot %s: sleeping', current_time, slot)
             case 'outbound_slot_connecting':
                 slot = info['slot']
                 addr = info['addr']
-                event = self.nodes[name]['event']
-                event[(f'{name}', f'{slot}')] = [f'connecting: addr={addr}', 0]
-                logging.debug(f'{current_time}  slot {slot}: connecting   addr={addr}')
+                events = node['event']
+                events[slot] = [f'connecting: addr={addr}', 0]
+                logging.debug('%s  slot %s: connecting   addr=%s',
+                              current_time, slot, addr)
             case 'outbound_slot_connected':
                 slot = info['slot']
                 addr = info['addr']
                 id = info['channel_id']
-                self.nodes[name]['outbound'][f'{slot}'] = [addr, id]
-                logging.debug(f'{current_time}  slot {slot}: connected    addr={addr}')
+                node['outbound'][slot] = [addr, id]
+                # The slot shows its address again, not its last event
+                node['event'].pop(slot, None)
+                logging.debug('%s  slot %s: connected    addr=%s',
+                              current_time, slot, addr)
             case 'outbound_slot_disconnected':
                 slot = info['slot']
                 err = info['err']
-                event = self.nodes[name]['event']
-                event[(f'{name}', f'{slot}')] = [f'disconnected: {err}', 0]
-                logging.debug(f'{current_time}  slot {slot}: disconnected err={err}')
+                events = node['event']
+                events[slot] = [f'disconnected: {err}', 0]
+                logging.debug('%s  slot %s: disconnected err=%s',
+                              current_time, slot, err)
             case 'outbound_peer_discovery':
                 attempt = info['attempt']
                 state = info['state']
-                event = self.nodes[name]['event']
-                key = (f'{name}', 'outbound')
-                event[key] = f'peer discovery: {state} (attempt {attempt})'
-                logging.debug(f'{current_time}  peer_discovery: {state} (attempt {attempt})')
-
-
-    def add_lilith(self, lilith):
-        #logging.debug(f'adding lilith {lilith}')
-        key = list(lilith.keys())[0]
-        values = list(lilith.values())[0]
+                events = node['event']
+                events['outbound'] = f'peer discovery: {state} (attempt {attempt})'
+                logging.debug('%s  peer_discovery: %s (attempt %s)',
+                              current_time, state, attempt)
+
+
+    # Takes a list of (name, values) pairs. Same as calling add_event()
+    # for each of them, but with the lookups for the frequent send/recv
+    # messages hoisted out of the loop.
+    def add_events(self, events):
+        self.notify()
+        nodes = self.nodes
+        msgs_by_name = {}
+        for (name, values) in events:
+            params = values['params'][0]
+            event = params['event']
+            if event not in ('send', 'recv'):
+                self.add_event(name, values)
+                continue
+            msgs = msgs_by_name.get(name)
+            if msgs is None:
+                msgs = msgs_by_name[name] = nodes[name]['msgs']
+            info = params['info']
+            t = format_time(int(info['time']) // 1_000_000_000)
+            msgs[info['chan']['addr']].append((t, event, info['cmd']))
+
+    def add_lilith(self, key, values):
+        self.notify()
+        #logging.debug(f'adding lilith {key}: {values}')
         info = values['result']
         spawns = info['spawns']
 
@@ -17,51 +17,109 @@
 
 import json
 import time
-import random
 import logging
 import asyncio
 
+# orjson is much faster for the small messages we send and returns bytes
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Compact UTF-8 like orjson's output. The defaults pad with spaces and
+# escape every non-ASCII character.
+json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+request_template = b'{"jsonrpc":"2.0","method":"%b","params":%b,"id":%d}\n'
+
+# Most calls take no params or a single flag, so those are formatted
+# straight into the template without going through the encoder.
+def encode_request(method, params, ident):
+    if not params:
+        return request_template % (method.encode(), b"[]", ident)
+    if len(params) == 1 and type(params[0]) is bool:
+        flag = b"[true]" if params[0] else b"[false]"
+        return request_template % (method.encode(), flag, ident)
+
+    request = {
+        "jsonrpc": "2.0",
+        "method": method,
+        "params": params,
+        "id": ident,
+    }
+    if orjson is not None:
+        return orjson.dumps(request) + b"\n"
+    return (json_encoder.encode(request) + "\n").encode()
+
+# Both parsers accept bytes and ignore the trailing newline
+def decode_response(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 class JsonRpc:
 
+    def __init__(self):
+        self.ident = 0
+
     async def start(self, host, port):
         logging.info(f"trying to connect to {host}:{port}")
-        reader, writer = await asyncio.open_connection(host, port)
+        # readline() fails on lines longer than the limit, and get_info
+        # replies from busy nodes easily outgrow the 64K default.
+        reader, writer = await asyncio.open_connection(host, port,
+                                                       limit=1024 * 256)
         self.reader = reader
         self.writer = writer
 
+    # Request ids only need to be unique among outstanding requests
+    def next_ident(self):
+        self.ident = (self.ident + 1) & 0xffff
+        return self.ident
+
     async def stop(self):
         self.writer.close()
-        await self.writer.wait_closed()
+        # A reset connection raises its error again here, it's closed anyway
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
 
     async def _make_request(self, method, params):
-        ident = random.randint(0, 2**16)
-        request = {
-            "jsonrpc": "2.0",
-            "method": method,
-            "params": params,
-            "id": ident,
-        }
-
-        message = json.dumps(request) + "\n"
-        self.writer.write(message.encode())
+        ident = self.next_ident()
+        self.writer.write(encode_request(method, params, ident))
         await self.writer.drain()
+        return await self.read_response()
+
+    # The server takes one request per line and answers each of them
+    # as soon as it's done, so write all the calls at once and then
+    # match the responses back to them by id.
+    async def _make_batch(self, calls):
+        idents = []
+        lines = []
+        for (method, params) in calls:
+            ident = self.next_ident()
+            idents.append(ident)
+            lines.append(encode_request(method, params, ident))
+
+        # Hand all the lines to the transport at once, flush them together
+        self.writer.writelines(lines)
+        await self.writer.drain()
+
+        responses = {}
+        for _ in idents:
+            response = await self.read_response()
+            responses[response.get("id")] = response
+        return [responses.get(ident) for ident in idents]
+
+    async def read_response(self):
         data = await self.reader.readline()
-        message = data.decode().strip()
-        response = json.loads(message)
-        return response
+        return decode_response(data)
 
     async def _subscribe(self, method, params):
-        ident = random.randint(0, 2**16)
-        request = {
-            "jsonrpc": "2.0",
-            "method": method,
-            "params": params,
-            "id": ident,
-        }
-
-        message = json.dumps(request) + "\n"
-        self.writer.write(message.encode())
+        ident = self.next_ident()
+        self.writer.write(encode_request(method, params, ident))
         await self.writer.drain()
         logging.debug("Subscribed")
 
@@ -16,6 +16,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import urwid
+from functools import lru_cache
 from urwid.widget import (BOX, FLOW, FIXED)
 
 # Scroll actions
@@ -26,6 +27,14 @@ SCROLL_PAGE_DOWN      = 'page down'
 SCROLL_TO_TOP         = 'to top'
 SCROLL_TO_END         = 'to end'
 
+# How far the relative scroll actions move, in (lines, pages)
+SCROLL_STEPS = {
+    SCROLL_LINE_UP:   (-1, 0),
+    SCROLL_LINE_DOWN: (1, 0),
+    SCROLL_PAGE_UP:   (0, -1),
+    SCROLL_PAGE_DOWN: (0, 1),
+}
+
 # Scrollbar positions
 SCROLLBAR_LEFT  = 'left'
 SCROLLBAR_RIGHT = 'right'
@@ -36,11 +45,19 @@ class ListBox_patched(urwid.ListBox):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._rows_max = None
+        # Total rows by maxcol, the same body wraps differently per width
+        self._rows_max = {}
 
     def _invalidate(self):
         super()._invalidate()
-        self._rows_max = None
+        self._rows_max = {}
+
+    # Check what kind of body we have once, when it's set, rather than
+    # on every scroll position lookup.
+    @urwid.listbox.ListBox.body.setter
+    def body(self, body):
+        urwid.listbox.ListBox.body.fset(self, body)
+        self._has_positions = hasattr(self._body, 'positions')
 
     def get_scrollpos(self, size, focus=False):
         """Current scrolling position
@@ -55,30 +72,34 @@ class ListBox_patched(urwid.ListBox):
             flow_size = (maxcol,)
 
             body = self.body
-            if hasattr(body, 'positions'):
+            if self._has_positions:
                 # For body[pos], pos can be anything, not just an int.  In that
                 # case, the positions() method returns an interable of valid
-                # positions.
-                positions = tuple(self.body.positions())
-                focus_index = positions.index(focus_pos)
-                widgets_above_focus = (body[pos] for pos in positions[:focus_index])
+                # positions. Walk them up to the focus in a single pass.
+                rows_above_focus = 0
+                for pos in body.positions():
+                    if pos == focus_pos:
+                        break
+                    rows_above_focus += body[pos].rows(flow_size)
             else:
                 # Treat body like a normal list
-                widgets_above_focus = (w for w in body[:focus_pos])
+                rows_above_focus = sum(w.rows(flow_size) for w in body[:focus_pos])
 
-            rows_above_focus = sum(w.rows(flow_size) for w in widgets_above_focus)
             rows_above_top = rows_above_focus - offset_rows
             return rows_above_top
 
     def rows_max(self, size, focus=False):
-        if self._rows_max is None:
-            flow_size = (size[0],)
+        maxcol = size[0]
+        rows_max = self._rows_max.get(maxcol)
+        if rows_max is None:
+            flow_size = (maxcol,)
             body = self.body
-            if hasattr(body, 'positions'):
-                self._rows_max = sum(body[pos].rows(flow_size) for pos in body.positions())
+            if self._has_positions:
+                rows_max = sum(body[pos].rows(flow_size) for pos in body.positions())
             else:
-                self._rows_max = sum(w.rows(flow_size) for w in self.body)
-        return self._rows_max
+                rows_max = sum(w.rows(flow_size) for w in self.body)
+            self._rows_max[maxcol] = rows_max
+        return rows_max
 
 urwid.ListBox = ListBox_patched
 
@@ -246,26 +267,15 @@ class Scrollable(urwid.WidgetDecoration):
             self._trim_top = 0  # Reset scroll position
             return
 
-        def ensure_bounds(new_trim_top):
-            return max(0, min(canv_rows - maxrow, new_trim_top))
-
-        if action == SCROLL_LINE_UP:
-            self._trim_top = ensure_bounds(trim_top - 1)
-        elif action == SCROLL_LINE_DOWN:
-            self._trim_top = ensure_bounds(trim_top + 1)
-
-        elif action == SCROLL_PAGE_UP:
-            self._trim_top = ensure_bounds(trim_top - maxrow+1)
-        elif action == SCROLL_PAGE_DOWN:
-            self._trim_top = ensure_bounds(trim_top + maxrow-1)
-
-        elif action == SCROLL_TO_TOP:
-            self._trim_top = 0
+        trim_max = canv_rows - maxrow
+        if action == SCROLL_TO_TOP:
+            trim_top = 0
         elif action == SCROLL_TO_END:
-            self._trim_top = canv_rows - maxrow
-
+            trim_top = trim_max
         else:
-            self._trim_top = ensure_bounds(trim_top)
+            lines, pages = SCROLL_STEPS.get(action, (0, 0))
+            trim_top += lines + pages * (maxrow - 1)
+        self._trim_top = max(0, min(trim_max, trim_top))
 
         # If the cursor was moved by the most recent keypress, adjust trim_top
         # so that the new cursor position is within the displayed canvas part.
@@ -327,6 +337,13 @@ class Scrollable(urwid.WidgetDecoration):
         return self._rows_max_cached
 
 
+# The scrollbar only ever shows a few different pieces, so render each
+# of them once instead of on every frame.
+@lru_cache(maxsize=128)
+def bar_canvas(attr, char, height, width):
+    return urwid.Text((attr, char * height * width), wrap="any").render((width,))
+
+
 DEFAULT_THUMB_CHAR = '\u2588'
 DEFAULT_TROUGH_CHAR = " "
 DEFAULT_SIDE = SCROLLBAR_RIGHT
@@ -393,13 +410,13 @@ class ScrollBar(urwid.WidgetDecoration):
 
         ow = self._original_widget
         ow_base = self.scrolling_base_widget
-        if not self.always_visible:
-            ow_rows_max = ow_base.rows_max(size, focus)
-            if ow_rows_max <= maxrow:
-                # Canvas fits without scrolling - no scrollbar needed
-                self._original_widget_size = size
-                return ow.render(size, focus)
+        # Rows only shrink as the width grows, so if the content fits next
+        # to the scrollbar it also fits in the full width.
         ow_rows_max = ow_base.rows_max(ow_size, focus)
+        if not self.always_visible and ow_rows_max <= maxrow:
+            # Canvas fits without scrolling - no scrollbar needed
+            self._original_widget_size = size
+            return ow.render(size, focus)
 
         ow_canv = ow.render(ow_size, focus)
         self._original_widget_size = ow_size
@@ -436,10 +453,9 @@ class ScrollBar(urwid.WidgetDecoration):
             elif hasattr(ow.body, "get_focus"):
                 pos = ow.body.get_focus()[1]
 
-            try:
-                head = next(iter(ow.body.positions()))
-            except StopIteration:
-                head = None
+            # Only the first position is taken, both walkers hand out
+            # positions lazily so this doesn't walk the whole body.
+            head = next(iter(ow.body.positions()), None)
             if pos == head:
                 if isinstance(self._thumb_indicator_top, tuple):
                     attr, char = self._thumb_indicator_top
@@ -447,16 +463,10 @@ class ScrollBar(urwid.WidgetDecoration):
                     attr, char = None, self._thumb_indicator_top
 
                 if char:
-                    thumb_top = urwid.Text(
-                        (attr, char * sb_width),
-                        wrap="any"
-                    ).render((sb_width,))
+                    thumb_top = bar_canvas(attr, char, 1, sb_width)
                     if thumb_height:
                         thumb_height -= 1
-            try:
-                tail = next(iter(ow.body.positions(reverse=True)))
-            except StopIteration:
-                tail = None
+            tail = next(iter(ow.body.positions(reverse=True)), None)
             if pos == tail:
                 if isinstance(self._thumb_indicator_bottom, tuple):
                     attr, char = self._thumb_indicator_bottom
@@ -464,10 +474,7 @@ class ScrollBar(urwid.WidgetDecoration):
                     attr, char = None, self._thumb_indicator_bottom
 
                 if char:
-                    thumb_bottom = urwid.Text(
-                        (attr, char * sb_width),
-                        wrap="any"
-                    ).render((sb_width,))
+                    thumb_bottom = bar_canvas(attr, char, 1, sb_width)
                     if thumb_height:
                         thumb_height -= 1
 
@@ -476,24 +483,15 @@ class ScrollBar(urwid.WidgetDecoration):
         else:
             trough_attr, trough_char = None, self._trough_char
 
-        top = urwid.Text(
-            (trough_attr, trough_char * top_height * sb_width),
-            wrap="any"
-        ).render((sb_width,))
+        top = bar_canvas(trough_attr, trough_char, top_height, sb_width)
 
         if isinstance(self._thumb_char, tuple):
             thumb_attr, thumb_char = self._thumb_char
         else:
             thumb_attr, thumb_char = (None, self._thumb_char)
-        thumb = urwid.Text(
-            (thumb_attr, thumb_char * thumb_height * sb_width),
-            wrap="any"
-        ).render((sb_width,))
+        thumb = bar_canvas(thumb_attr, thumb_char, thumb_height, sb_width)
 
-        bottom = urwid.Text(
-            (trough_attr, trough_char * bottom_height * sb_width),
-            wrap="any"
-        ).render((sb_width,))
+        bottom = bar_canvas(trough_attr, trough_char, bottom_height, sb_width)
 
 
         sb_canv = urwid.CanvasCombine(
@@ -569,6 +567,10 @@ class ScrollBar(urwid.WidgetDecoration):
                 pos = ow.get_scrollpos(ow_size)
                 ow.set_scrollpos(pos + 1)
                 return True
+        elif not handled and button in (4, 5):
+            # A ListBox has no set_scrollpos, scroll it like the arrow keys
+            ow.keypress(ow_size, 'up' if button == 4 else 'down')
+            return True
 
         return False
 
@@ -17,9 +17,11 @@
 
 import os
 import sys
-import toml
 import platform
+from functools import lru_cache
 
+# Neither of these can change while we're running
+@lru_cache(maxsize=None)
 def get_os():
    if sys.platform.startswith('java'):
       os_name = platform.java_ver()[3][0]
@@ -33,6 +35,7 @@ def get_os():
         system = sys.platform
    return system
 
+@lru_cache(maxsize=None)
 def user_config_dir(appname, system):
    if system == "win32":
        path = windows_dir(appname)
@@ -44,24 +47,26 @@ def user_config_dir(appname, system):
        path = os.path.join(path, appname)
    return path
 
+# APPDATA is where CSIDL_APPDATA points to, no need to ask the shell
 def windows_dir(appname):
-   appauthor = appname
-   const = "CSIDL_APPDATA"
-   path = os.path.normpath(_get_win_folder(const))
-   path = os.path.join(path, appname)
-   return path
+   path = os.path.normpath(os.environ['APPDATA'])
+   return os.path.join(path, appname)
 
 def spawn_config(path):
     file_exists = os.path.exists(path)
     if file_exists:
+        # Only needed here, first runs just copy the default config
+        import toml
         with open(path) as f:
             cfg = toml.load(f)
             return cfg
     else:
-        with open('dnet_config.toml') as f:
-            cfg = toml.load(f)
-        with open(path, 'w') as f:
-            toml.dump(cfg, f)
+        # Copy the default config as is, there's no need to parse and
+        # reserialize it, and this keeps its comments.
+        with open('dnet_config.toml', 'rb') as f:
+            raw = f.read()
+        with open(path, 'wb') as f:
+            f.write(raw)
         print(f"Config file created in {path}. Please review it and try again.")
         sys.exit(0)
         
@@ -20,14 +20,74 @@ import logging
 import asyncio
 import datetime as dt
 
-from src.scroll import ScrollBar, Scrollable
+from collections import defaultdict as dd
+from src.scroll import ScrollBar
 from src.model import Model
 
 
+# Lines of the right panel. The ListBox only asks for the rows it
+# shows, so a Text is only built for a line once it's needed, and a
+# line that's still there after an update keeps its widget.
+class LineWalker(urwid.ListWalker):
+    def __init__(self):
+        self.lines = []
+        self.widgets = {}
+        self.old_widgets = {}
+        self.focus = 0
+
+    def set_lines(self, lines):
+        self.lines = lines
+        self.old_widgets = self.widgets
+        self.widgets = {}
+        self.focus = min(self.focus, max(len(lines) - 1, 0))
+        self._modified()
+
+    def __getitem__(self, pos):
+        if not 0 <= pos < len(self.lines):
+            raise IndexError(pos)
+        line = self.lines[pos]
+        w = self.widgets.get(line)
+        if w is None:
+            w = self.old_widgets.pop(line, None) or urwid.Text(line)
+            self.widgets[line] = w
+        return w
+
+    def next_position(self, pos):
+        return pos + 1
+
+    def prev_position(self, pos):
+        return pos - 1
+
+    def set_focus(self, pos):
+        self.focus = pos
+        self._modified()
+
+    def positions(self, reverse=False):
+        if reverse:
+            return range(len(self.lines) - 1, -1, -1)
+        return range(len(self.lines))
+
+
 class DnetWidget(urwid.WidgetWrap):
     def __init__(self, node_name, session):
+        urwid.Widget.__init__(self)
         self.node_name = node_name
         self.session = session
+        self.txt = ""
+        self.wrapped = None
+
+    # The urwid widgets are only built once the row is actually
+    # rendered, so rows outside the viewport just hold their text.
+    @property
+    def _wrapped_widget(self):
+        if self.wrapped is None:
+            self.wrapped = urwid.AttrWrap(urwid.Text(self.txt), None)
+            self.wrapped.focus_attr = 'line'
+        return self.wrapped
+
+    @_wrapped_widget.setter
+    def _wrapped_widget(self, w):
+        self.wrapped = w
 
     def selectable(self):
         return True
@@ -35,45 +95,54 @@ class DnetWidget(urwid.WidgetWrap):
     def keypress(self, size, key):
         return key
 
+    # Reuse the already built Text rather than wrapping a new one
     def update(self, txt):
-        super().__init__(txt)
-        self._w = urwid.AttrWrap(self._w, None)
-        self._w.focus_attr = 'line'
+        if txt == self.txt:
+            return
+        self.txt = txt
+        if self.wrapped is not None:
+            self.wrapped.original_widget.set_text(txt)
+        self._invalidate()
 
 
 class Node(DnetWidget):
     def set_txt(self, is_empty: bool):
         if is_empty:
-            txt = urwid.Text(f"{self.node_name} (offline)")
-            super().update(txt)
+            super().update(f"{self.node_name} (offline)")
         else:
-            txt = urwid.Text(f"{self.node_name}")
-            super().update(txt)
+            super().update(f"{self.node_name}")
 
 
 class Session(DnetWidget):
     def set_txt(self):
-        txt = urwid.Text(f"  {self.session}")
-        super().update(txt)
+        super().update(f"  {self.session}")
 
 
 class Slot(DnetWidget):
+    # (i, addr) the text was last built from
+    shown = None
+
     def set_txt(self, i, addr):
+        # Slots are redrawn every tick but rarely change, so don't even
+        # format the text again when they didn't.
+        if self.shown == (i, addr):
+            return
+        self.shown = (i, addr)
+
         self.i = i
         if self.session == "outbound-slot":
             self.addr = addr[0]
             self.id = addr[1]
-            txt = urwid.Text(f"    {self.i}: {self.addr}")
+            txt = f"    {self.i}: {self.addr}"
 
-        if self.session == "spawn-slot":
+        elif self.session == "spawn-slot":
             self.id = addr
-            txt = urwid.Text(f"    {addr}")
+            txt = f"    {addr}"
 
-        if (self.session == "manual-slot"
-            or self.session == "seed-slot"
-            or self.session == "inbound-slot"):
+        else:
+            # manual, seed and inbound slots
             self.addr = addr
-            txt = urwid.Text(f"    {self.addr}")
+            txt = f"    {self.addr}"
         super().update(txt)
     
 
@@ -82,352 +151,303 @@ class View():
               ('body','light gray','default', 'standout'),
               ('line','dark cyan','default','standout'),
               ]
+    # Node sessions drawn in the left panel, with the session of their
+    # slots. Empty entries (disconnected inbound slots) are skipped.
+    sessions = (
+        ('outbound', 'outbound-slot'),
+        ('inbound', 'inbound-slot'),
+        ('manual', 'manual-slot'),
+        ('seed', 'seed-slot'),
+    )
+    # Lists shown in the right panel for a lilith spawn
+    spawn_lists = (
+        ('urls', 'Accept addrs:'),
+        ('whitelist', 'Whitelist:'),
+        ('greylist', 'Greylist:'),
+        ('anchorlist', 'Anchorlist:'),
+    )
 
     def __init__(self, model):
         self.model = model
-        info_text = urwid.Text("")
-        self.pile = urwid.Pile([info_text])
-        scroll = ScrollBar(Scrollable(self.pile))
+        self.lines = LineWalker()
+        scroll = ScrollBar(urwid.ListBox(self.lines))
         rightbox = urwid.LineBox(scroll)
         self.listbox_content = []
         self.listwalker = urwid.SimpleListWalker(self.listbox_content)
         self.listw = self.listwalker.contents
         self.list = urwid.ListBox(self.listwalker)
+        self.last_focus = None
+        urwid.connect_signal(self.listwalker, 'modified', self.focus_changed)
         leftbox = urwid.LineBox(self.list)
         columns = urwid.Columns([leftbox, rightbox], focus_column=0)
         self.ui = urwid.Frame(urwid.AttrWrap( columns, 'body' ))
-        self.known_outbound = []
-        self.known_inbound = []
-        self.known_nodes = []
-        self.live_nodes = []
-        self.dead_nodes = []
+        # Slot ids shown for each node
+        self.known_outbound = dd(set)
+        self.known_inbound = dd(set)
+        self.known_nodes = set()
+        self.live_nodes = set()
+        self.dead_nodes = set()
         self.refresh = False
+        # Row widgets by (class, node, session, key). Rows drawn before
+        # the last refresh are kept in old_rows until they're reused.
+        self.rows = {}
+        self.old_rows = {}
+        # Set when widgets changed during this tick and the screen
+        # needs to be redrawn
+        self.dirty = False
+        # (focused widget, model version) the right panel was built for
+        self.last_fill = (None, None)
+        # Lines currently shown in the right panel
+        self.last_lines = []
+        # What the right panel shows for each kind of focused row
+        self.right_box_handlers = {
+            "outbound": self.outbound_lines,
+            "outbound-slot": self.msg_lines,
+            "inbound-slot": self.msg_lines,
+            "manual-slot": self.msg_lines,
+            "seed-slot": self.msg_lines,
+            "spawn-slot": self.spawn_lines,
+        }
+
+    # Moving the focus changes what the right hand panel shows, so wake
+    # update_view just like a model update would.
+    def focus_changed(self):
+        if self.listwalker.focus != self.last_focus:
+            self.last_focus = self.listwalker.focus
+            self.model.changed.set()
+
+    # Hand out the widget for a row, reusing the one drawn for it last
+    # time so redrawing only updates its text.
+    def row(self, cls, node_name, session, key=None):
+        k = (cls, node_name, session, key)
+        w = self.rows.get(k)
+        if w is None:
+            w = self.old_rows.pop(k, None)
+            if w is None:
+                w = cls(node_name, session)
+            self.rows[k] = w
+        return w
 
     #-----------------------------------------------------------------
     # Render dnet.get_info() RPC call
     #-----------------------------------------------------------------
+    # The draw_* functions return the rows for a node, display() adds
+    # all of them to the list in one go.
     def draw_info(self, node_name, info):
         #logging.debug('draw_info() [START]')
         if 'spawns' in info:
             #logging.debug(f'drawing lilith name={node_name} info={info}')
-            self.draw_lilith(node_name, info)
+            return self.draw_lilith(node_name, info)
 
         else:
             #logging.debug(f'drawing node name={node_name} info={info}')
-            node = Node(node_name, "node")
+            rows = []
+            node = self.row(Node, node_name, "node")
             node.set_txt(False)
-            self.listw.append(node)
+            rows.append(node)
             
-            if 'outbound' in info and info['outbound']:
-                session = Session(node_name, "outbound")
-                session.set_txt()
-                self.listw.append(session)
-                for i, addr in info['outbound'].items():
-                    slot = Slot(node_name, "outbound-slot")
-                    slot.set_txt(i, addr)
-                    self.listw.append(slot)
-
-            if 'inbound' in info and info['inbound']:
-                if any(info['inbound'].values()):
-                    session = Session(node_name, "inbound")
-                    session.set_txt()
-                    self.listw.append(session)
-                    for i, addr in info['inbound'].items():
-                        if bool(addr):
-                            slot = Slot(node_name, "inbound-slot")
-                            slot.set_txt(i, addr)
-                            self.listw.append(slot)
-
-            if 'manual' in info and info['manual']:
-                session = Session(node_name, "manual")
-                session.set_txt()
-                self.listw.append(session)
-                for i, addr in info['manual'].items():
-                    slot = Slot(node_name, "manual-slot")
-                    slot.set_txt(i, addr)
-                    self.listw.append(slot)
-
-            if 'seed' in info and info['seed']:
-                session = Session(node_name, "seed")
+            for key, slot_session in self.sessions:
+                slots = [(i, addr) for i, addr in info.get(key, {}).items()
+                         if addr]
+                if not slots:
+                    continue
+                session = self.row(Session, node_name, key)
                 session.set_txt()
-                self.listw.append(session)
-                for i, info in info['seed'].items():
-                    slot = Slot(node_name, "seed-slot")
+                rows.append(session)
+                for i, addr in slots:
+                    slot = self.row(Slot, node_name, slot_session, i)
                     slot.set_txt(i, addr)
-                    self.listw.append(slot)
+                    rows.append(slot)
+            return rows
 
     def draw_lilith(self, node_name, info):
-        node = Node(node_name, "lilith-node")
+        rows = []
+        node = self.row(Node, node_name, "lilith-node")
         node.set_txt(False)
-        self.listw.append(node)
+        rows.append(node)
         for (i, key) in enumerate(info['spawns'].keys()):
-            slot = Slot(node_name, "spawn-slot")
+            slot = self.row(Slot, node_name, "spawn-slot", key)
             slot.set_txt(i, key)
-            self.listw.append(slot)
+            rows.append(slot)
+        return rows
 
     def draw_empty(self, node_name, info):
-        node = Node(node_name, "node")
+        node = self.row(Node, node_name, "node")
         node.set_txt(True)
-        self.listw.append(node)
+        return [node]
 
     #-----------------------------------------------------------------
     # Render dnet.subscribe_events() RPC call 
     # Left hand panel only
     #-----------------------------------------------------------------
     def fill_left_box(self):
-        live_inbound = []
-        new_inbound= {}
-        for index, item in enumerate(self.listw):
-            # Update outbound slot info
-            if item.session == "outbound-slot":
-                key = (f"{item.node_name}", f"{item.i}")
-                if key in self.model.nodes[item.node_name]['event']:
-                    info = self.model.nodes[item.node_name]['event'].get(key)
-                    slot = Slot(item.node_name, item.session)
-                    slot.set_txt(item.i, info)
-                    self.listw[index] = slot
-
-    #-----------------------------------------------------------------
-    # Render lilith.spawns() RPC call 
-    # Right hand panel only
-    #-----------------------------------------------------------------
-    def fill_lilith_right_box(self):
-        self.pile.contents.clear()
-        focus_w = self.list.get_focus()
-        if focus_w[0] is None:
-            return
-        session = focus_w[0].session
-        if session == "spawn-slot":
-            node_name = focus_w[0].node_name
-            spawn_name = focus_w[0].id
-            lilith = self.model.liliths.get(node_name)
-            spawns = lilith.get('spawns')
-            info = spawns.get(spawn_name)
-
-            if info['urls']:
-                urls = info['urls']
-                self.pile.contents.append((urwid.Text(
-                    f"Accept addrs:"),
-                    self.pile.options()))
-                for url in urls:
-                    self.pile.contents.append((urwid.Text(
-                        f"  {url}"),
-                        self.pile.options()))
-
-            if info['whitelist']:
-                whitelist = info['whitelist']
-                self.pile.contents.append((urwid.Text(
-                    f"Whitelist:"),
-                    self.pile.options()))
-                for host in whitelist:
-                    self.pile.contents.append((urwid.Text(
-                        f"  {host}"),
-                        self.pile.options()))
-
-            if info['greylist']:
-                greylist = info['greylist']
-                self.pile.contents.append((urwid.Text(
-                    f"Greylist:"),
-                    self.pile.options()))
-                for host in greylist:
-                    self.pile.contents.append((urwid.Text(
-                        f"  {host}"),
-                        self.pile.options()))
-
-            if info['anchorlist']:
-                anchorlist = info['anchorlist']
-                self.pile.contents.append((urwid.Text(
-                    f"Anchorlist:"),
-                    self.pile.options()))
-                for host in anchorlist:
-                    self.pile.contents.append((urwid.Text(
-                        f"  {host}"),
-                        self.pile.options()))
+        # Go from the slot events to the rows showing them, rather than
+        # looking at every row in the list.
+        for name, info in self.model.nodes.items():
+            for i, event in info.get('event', {}).items():
+                slot = self.rows.get((Slot, name, "outbound-slot", i))
+                if slot is None:
+                    continue
+                txt = slot.txt
+                slot.set_txt(i, event)
+                if slot.txt != txt:
+                    self.dirty = True
 
     #-----------------------------------------------------------------
-    # Render dnet.subscribe_events() RPC call
+    # Render dnet.subscribe_events() and lilith.spawns() RPC calls
     # Right hand menu only
     #-----------------------------------------------------------------
     def fill_right_box(self):
-        self.pile.contents.clear()
         focus_w = self.list.get_focus()
-        if focus_w[0] is None:
+        # Nothing to redo if neither the focus nor the model changed
+        key = (focus_w[0], self.model.version)
+        if key == self.last_fill:
             return
-        session = focus_w[0].session
-
-        if session == "outbound":
-            key = (focus_w[0].node_name, "outbound")
-            info = self.model.nodes.get(focus_w[0].node_name)
-            if key in info['event']:
-                ev = info['event'].get(key)
-                self.pile.contents.append((
-                    urwid.Text(f" {ev}"),
-                    self.pile.options()))
-
-        if (session == "outbound-slot" or session == "inbound-slot"
-                or session == "manual-slot" or session == "seed-slot"):
-            addr = focus_w[0].addr
-            node_name = focus_w[0].node_name
-            info = self.model.nodes.get(node_name)
-
-            if addr in info['msgs']:
-                msg = info['msgs'].get(addr)
-                for m in msg:
-                    time = m[0]
-                    event = m[1]
-                    msg = m[2]
-                    self.pile.contents.append((urwid.Text(
-                            f"{time}: {event}: {msg}"),
-                            self.pile.options()))
-
-        if session == "spawn-slot":
-            node_name = focus_w[0].node_name
-            spawn_name = focus_w[0].id
-            lilith = self.model.liliths.get(node_name)
-            spawns = lilith.get('spawns')
-            info = spawns.get(spawn_name)
-
-            if info['urls']:
-                urls = info['urls']
-                self.pile.contents.append((urwid.Text(
-                    f"Accept addrs:"),
-                    self.pile.options()))
-                for url in urls:
-                    self.pile.contents.append((urwid.Text(
-                        f"  {url}"),
-                        self.pile.options()))
-
-            if info['whitelist']:
-                whitelist = info['whitelist']
-                self.pile.contents.append((urwid.Text(
-                    f"Whitelist:"),
-                    self.pile.options()))
-                for host in whitelist:
-                    self.pile.contents.append((urwid.Text(
-                        f"  {host}"),
-                        self.pile.options()))
-
-            if info['greylist']:
-                greylist = info['greylist']
-                self.pile.contents.append((urwid.Text(
-                    f"Greylist:"),
-                    self.pile.options()))
-                for host in greylist:
-                    self.pile.contents.append((urwid.Text(
-                        f"  {host}"),
-                        self.pile.options()))
-
-            if info['anchorlist']:
-                anchorlist = info['anchorlist']
-                self.pile.contents.append((urwid.Text(
-                    f"Anchorlist:"),
-                    self.pile.options()))
-                for host in anchorlist:
-                    self.pile.contents.append((urwid.Text(
-                        f"  {host}"),
-                        self.pile.options()))
+        self.last_fill = key
+
+        lines = []
+        if focus_w[0] is not None:
+            handler = self.right_box_handlers.get(focus_w[0].session)
+            if handler is not None:
+                lines = list(handler(focus_w[0]))
+        # Most updates are for other nodes or slots. Leaving the pile
+        # untouched keeps its canvas in urwid's render cache.
+        if lines == self.last_lines:
+            return
+        self.last_lines = lines
+
+        self.dirty = True
+        self.lines.set_lines(lines)
+
+    def outbound_lines(self, w):
+        info = self.model.nodes.get(w.node_name)
+        event = info['event'].get("outbound")
+        if event is not None:
+            yield f" {event}"
+
+    def msg_lines(self, w):
+        info = self.model.nodes.get(w.node_name)
+        # msgs is a defaultdict, so don't index it for unknown addrs
+        msgs = info['msgs'].get(w.addr)
+        if msgs is not None:
+            for (time, event, msg) in msgs:
+                yield f"{time}: {event}: {msg}"
+
+    def spawn_lines(self, w):
+        lilith = self.model.liliths.get(w.node_name)
+        info = lilith['spawns'].get(w.id)
+        for key, heading in self.spawn_lists:
+            if info[key]:
+                yield heading
+                for host in info[key]:
+                    yield f"  {host}"
+
+    # Refreshes run in display(), which may already be done for this
+    # tick, so wake update_view rather than waiting for the next event.
+    def schedule_refresh(self):
+        self.refresh = True
+        self.model.changed.set()
 
     #-----------------------------------------------------------------
     # Sort through node info, checking whether we are already 
     # tracking this node or if the node's state has changed.
     #-----------------------------------------------------------------
     def sort(self, nodes):
-        for name, info in nodes:
-            if bool(info) and name not in self.live_nodes:
-                self.live_nodes.append(name)
-            if not bool(info) and name not in self.dead_nodes:
-                self.dead_nodes.append(name)
-            if bool(info) and name in self.dead_nodes:
-                logging.debug("Refresh: dead node online.")
-                self.refresh = True
-            if not bool(info) and name in self.live_nodes:
-                logging.debug("Refresh: online node offline.")
-                self.refresh = True
+        live = {name for name, info in nodes if info}
+        dead = {name for name, info in nodes if not info}
+        if live & self.dead_nodes:
+            logging.debug("Refresh: dead node online.")
+            self.schedule_refresh()
+        if dead & self.live_nodes:
+            logging.debug("Refresh: online node offline.")
+            self.schedule_refresh()
+        self.live_nodes |= live
+        self.dead_nodes |= dead
 
     #-----------------------------------------------------------------
     # Checks whether we are already displaying this node, and draw
     # it if not. 
     #-----------------------------------------------------------------
     async def display(self, nodes):
+        rows = []
         for name, info in nodes:
-            if name in self.live_nodes and name not in self.known_nodes:
-                self.draw_info(name, info)
-            if name in self.dead_nodes and name not in self.known_nodes:
-                self.draw_empty(name, info)
-            if self.refresh:
-                logging.debug("Refresh initiated.")
-                await asyncio.sleep(0.1)
-                self.known_outbound.clear()
-                self.known_inbound.clear()
-                self.known_nodes.clear()
-                self.live_nodes.clear()
-                self.dead_nodes.clear()
-                self.refresh = False
-                self.listw.clear()
-                logging.debug("Refresh complete.")
+            if name in self.known_nodes:
+                continue
+            if name in self.live_nodes:
+                rows += self.draw_info(name, info)
+            elif name in self.dead_nodes:
+                rows += self.draw_empty(name, info)
+        # One modified signal for all the new rows
+        if rows:
+            self.listw.extend(rows)
+            self.dirty = True
+        if self.refresh:
+            logging.debug("Refresh initiated.")
+            await asyncio.sleep(0.1)
+            self.known_outbound.clear()
+            self.known_inbound.clear()
+            self.known_nodes.clear()
+            self.live_nodes.clear()
+            self.dead_nodes.clear()
+            self.refresh = False
+            self.listw.clear()
+            # Anything not drawn again before the next refresh is dropped
+            self.old_rows = self.rows
+            self.rows = {}
+            self.dirty = True
+            # Redraw everything on the next tick
+            self.model.changed.set()
+            logging.debug("Refresh complete.")
+
     #-----------------------------------------------------------------
     # Handle events.
     #-----------------------------------------------------------------
     def draw_events(self, nodes):
         for name, info in nodes:
-            if bool(info) and name in self.known_nodes:
-                self.fill_left_box()
-                self.fill_right_box()
-
-                if 'inbound' in info:
-                    # New inbound online.
-                    for key in info['inbound'].keys():
-                        if key not in self.known_inbound:
-                            addr = info['inbound'].get(key)
-                            if not bool(addr) or not addr == None:
-                                continue
-                            logging.debug(f"Refresh: inbound {key} online")
-                            self.refresh = True
-
-                    # Known inbound offline.
-                    for key in self.known_inbound:
-                        addr = info['inbound'].get(key)
-                        if bool(addr) or addr == None:
-                            continue
-                        logging.debug(f"Refresh: inbound {key} offline")
-                        self.refresh = True
-
-                # New outbound online.
-                if 'outbound' in info:
-                    for i, info in info['outbound'].items():
-                        addr = info[0]
-                        id = info[1]
-                        if id == 0:
-                            continue
-                        if id in self.known_outbound:
-                            continue
-                        logging.debug(f"Outbound {i}, {addr} came online.")
-                        self.refresh = True
+            if not info or name not in self.known_nodes:
+                continue
+
+            if 'inbound' in info:
+                inbound = {id for id, addr in info['inbound'].items() if addr}
+                known = self.known_inbound[name]
+                for id in inbound - known:
+                    logging.debug(f"Refresh: inbound {id} online")
+                for id in known - inbound:
+                    logging.debug(f"Refresh: inbound {id} offline")
+                if inbound != known:
+                    self.schedule_refresh()
+
+            if 'outbound' in info:
+                outbound = {id for (addr, id) in info['outbound'].values()
+                            if id != 0}
+                for id in outbound - self.known_outbound[name]:
+                    logging.debug(f"Outbound {id} came online.")
+                    self.schedule_refresh()
     
     async def update_view(self, evloop: asyncio.AbstractEventLoop,
                           loop: urwid.MainLoop):
         while True:
-            await asyncio.sleep(0.1)
+            # Sleep until the model or focus changes. The timeout still
+            # refreshes the screen every now and then.
+            try:
+                await asyncio.wait_for(self.model.changed.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            self.model.changed.clear()
 
-            nodes = self.model.nodes.items()
-            liliths = self.model.liliths.items()
-            evloop.call_soon(loop.draw_screen)
+            nodes, liliths = self.model.items()
 
             # We first ensure that we are keeping track
             # of all the displayed widgets.
             for index, item in enumerate(self.listw):
                 # Keep track of known nodes.
-                if item.node_name not in self.known_nodes:
-                    self.known_nodes.append(item.node_name)
+                self.known_nodes.add(item.node_name)
                 # Keep track of known inbounds.
-                if (item.session == "inbound-slot"
-                        and item.i not in self.known_inbound):
-                    self.known_inbound.append(item.i)
+                if item.session == "inbound-slot":
+                    self.known_inbound[item.node_name].add(item.i)
                 # Keep track of known outbounds.
-                if (item.session == "outbound-slot"
-                        and item.id not in self.known_outbound
-                        and not item.id == 0):
-                    self.known_outbound.append(item.id)
+                if item.session == "outbound-slot" and item.id != 0:
+                    self.known_outbound[item.node_name].add(item.id)
 
             self.sort(nodes)
             self.sort(liliths)
@@ -435,5 +455,11 @@ class View():
             await self.display(nodes)
             await self.display(liliths)
 
-            self.fill_lilith_right_box()
+            self.fill_left_box()
+            self.fill_right_box()
             self.draw_events(nodes)
+
+            # Redraw once for all of this tick's changes, if any
+            if self.dirty:
+                self.dirty = False
+                evloop.call_soon(loop.draw_screen)